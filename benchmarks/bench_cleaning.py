@@ -0,0 +1,139 @@
+"""Micro-benchmarks for content block cleaning.
+
+Compares the compiled CleaningPipeline with the previous per-call chain
+(regexes compiled on every call and one model copy per step), either on
+synthetic blocks or on event pages recorded with bench_parsers.py:
+
+    python benchmarks/bench_cleaning.py
+    python benchmarks/bench_cleaning.py --venue cine-dore --directory recorded/
+"""
+
+import re
+import timeit
+from pathlib import Path
+from uuid import UUID
+
+import typer
+from markdownify import markdownify
+from pydantic import TypeAdapter
+from typing_extensions import Annotated
+
+from lagransala.models import ContentBlock, ContentBlockSpec
+from lagransala.scraping.parsers import get_parser
+
+cli = typer.Typer()
+
+
+def legacy_clean(spec: ContentBlockSpec, content: str | None) -> str | None:
+    if content is None:
+        return None
+    content = markdownify(
+        content,
+        strip=["script", "style"] + spec.strip_elements,
+        heading_style="ATX",
+        bullets="-",
+    )
+    return legacy_steps(spec, content)
+
+
+def legacy_steps(spec: ContentBlockSpec, content: str | None) -> str | None:
+    for regex in spec.remove_regex:
+        if content is None:
+            break
+        if content == "":
+            content = None
+            break
+        content = re.sub(regex, "", content) or None
+    if content is None:
+        return None
+    content = re.sub(r"\n\s*\n\s*\n", "\n\n", content)
+    content = "\n".join(line.rstrip() for line in content.splitlines())
+    content = content.strip() + "\n"
+    return None if content in ["", " ", "\n"] else content
+
+
+def synthetic_blocks(count: int) -> list[ContentBlock]:
+    spec = ContentBlockSpec(
+        venue_spec_id=UUID(hex="96c480da116f405b84543ea092adede6"),
+        selector="#textoFicha",
+        relevant="details",
+        remove_regex=[
+            r"- (\w|\d|\\|\*|\/|-)+:.*",
+            r"- \d\d mm:.*",
+            r"Las sesiones anunciadas[\w\s\.]+aproximadas\.",
+        ],
+    )
+    html = (
+        "<div><h2>Título</h2><ul><li>Dirección: Fulano</li><li>35 mm: sí</li></ul>"
+        + "<p>Una película <b>muy</b> larga.</p>\n\n\n" * 20
+        + "<p>Las sesiones anunciadas son aproximadas.</p></div>"
+    )
+    return [ContentBlock(spec=spec, content=html) for _ in range(count)]
+
+
+def recorded_blocks(venue_slug: str, directory: Path) -> list[ContentBlock]:
+    from bench_parsers import load_spec
+
+    spec = load_spec(venue_slug)
+    parser = get_parser("lxml")
+    selectors = [block_spec.selector for block_spec in spec.content_block_specs]
+    blocks: list[ContentBlock] = []
+    for path in sorted(directory.glob("event-*.html")):
+        contents = parser.blocks(path.read_text(), selectors)
+        blocks.extend(
+            ContentBlock(spec=block_spec, content=content)
+            for block_spec, content in zip(spec.content_block_specs, contents)
+        )
+    return blocks
+
+
+@cli.command()
+def run(
+    venue: Annotated[str | None, typer.Option()] = None,
+    directory: Annotated[Path | None, typer.Option()] = None,
+    count: Annotated[int, typer.Option()] = 200,
+    repeat: Annotated[int, typer.Option()] = 5,
+):
+    if venue is not None and directory is not None:
+        blocks = recorded_blocks(venue, directory)
+    else:
+        blocks = synthetic_blocks(count)
+    for block, cleaned in zip(blocks, ContentBlock.clean_many(blocks)):
+        assert legacy_clean(block.spec, block.content) == cleaned.content
+
+    markdown = [
+        (block.spec, block.spec.cleaning_pipeline.markdown(block.content))
+        for block in blocks
+        if block.content is not None
+    ]
+    # Before, cache hits stored raw HTML and paid the full legacy cost again
+    adapter = TypeAdapter(list[ContentBlock])
+    raw_json = adapter.dump_json(blocks)
+    cleaned_json = adapter.dump_json(ContentBlock.clean_many(blocks))
+    cases = {
+        "legacy html -> clean": lambda: [
+            legacy_clean(block.spec, block.content) for block in blocks
+        ],
+        "pipeline html -> clean": lambda: ContentBlock.clean_many(blocks),
+        "legacy cleaning steps": lambda: [
+            legacy_steps(spec, content) for spec, content in markdown
+        ],
+        "pipeline cleaning steps": lambda: [
+            spec.cleaning_pipeline.clean(content) for spec, content in markdown
+        ],
+        "legacy cache hit": lambda: [
+            legacy_clean(block.spec, block.content)
+            for block in adapter.validate_json(raw_json)
+        ],
+        "cleaned cache hit": lambda: adapter.validate_json(cleaned_json),
+    }
+    print(f"{len(blocks)} blocks, best of {repeat}")
+    for name, case in cases.items():
+        best = min(timeit.repeat(case, number=1, repeat=repeat))
+        print(
+            f"{name:>26}: {best * 1000:8.2f}ms ({best / len(blocks) * 1e6:.0f}us/block)"
+        )
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,102 @@
+"""Compare HTML parser backends on recorded venue pages.
+
+python benchmarks/bench_parsers.py record cine-dore recorded/
+python benchmarks/bench_parsers.py run cine-dore recorded/
+"""
+
+import asyncio
+import re
+import time
+from pathlib import Path
+from urllib.parse import urljoin
+from uuid import UUID
+
+import aiohttp
+import typer
+import yaml
+from typing_extensions import Annotated
+
+from lagransala.models import ContentBlockSpec, VenueSpec
+from lagransala.scraping.parsers import PARSERS, get_parser
+
+cli = typer.Typer()
+
+
+def load_spec(venue_slug: str) -> VenueSpec:
+    with open("seeders/venues.yaml") as f:
+        venue_ids = {raw["slug"]: UUID(hex=raw["id"]) for raw in yaml.safe_load(f)}
+    with open("seeders/specs.yaml") as f:
+        for raw_spec in yaml.safe_load(f):
+            if UUID(hex=raw_spec["venue_id"]) == venue_ids[venue_slug]:
+                spec = VenueSpec.model_validate(raw_spec)
+                spec.content_block_specs = [
+                    ContentBlockSpec.model_validate(
+                        {**raw_block, "venue_spec_id": spec.id}
+                    )
+                    for raw_block in raw_spec["content_block_specs"]
+                ]
+                return spec
+    raise ValueError(f"No spec found for {venue_slug}")
+
+
+@cli.command()
+def record(venue_slug: str, directory: Path, events: int = 10):
+    spec = load_spec(venue_slug)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    async def fetch_all():
+        parser = get_parser("lxml")
+        pattern = re.compile(spec.event_url_pattern)
+        event_urls: set[str] = set()
+        async with aiohttp.ClientSession() as session:
+            for i, url in enumerate(spec.pagination_urls):
+                async with session.get(str(url)) as response:
+                    html = await response.text()
+                (directory / f"page-{i:03}.html").write_text(html)
+                event_urls.update(
+                    link for link in parser.links(html) if pattern.match(link)
+                )
+            for i, link in enumerate(sorted(event_urls)[:events]):
+                async with session.get(urljoin(str(url), link)) as response:
+                    html = await response.text()
+                (directory / f"event-{i:03}.html").write_text(html)
+
+    asyncio.run(fetch_all())
+
+
+@cli.command()
+def run(
+    venue_slug: str,
+    directory: Path,
+    repeat: Annotated[int, typer.Option()] = 5,
+):
+    spec = load_spec(venue_slug)
+    pattern = re.compile(spec.event_url_pattern)
+    selectors = [block_spec.selector for block_spec in spec.content_block_specs]
+    pages = [path.read_text() for path in sorted(directory.glob("page-*.html"))]
+    events = [path.read_text() for path in sorted(directory.glob("event-*.html"))]
+    print(f"{len(pages)} listing pages, {len(events)} event pages, x{repeat}")
+
+    baseline: float | None = None
+    for name in PARSERS:
+        parser = get_parser(name)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for html in pages:
+                {link for link in set(parser.links(html)) if pattern.match(link)}
+        links_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for html in events:
+                parser.blocks(html, selectors)
+        blocks_time = time.perf_counter() - start
+        total = links_time + blocks_time
+        baseline = baseline or total
+        print(
+            f"{name:>12}: links {links_time:7.3f}s  blocks {blocks_time:7.3f}s  "
+            f"speedup x{baseline / total:.1f}"
+        )
+
+
+if __name__ == "__main__":
+    cli()
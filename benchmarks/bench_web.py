@@ -0,0 +1,88 @@
+"""Load test a running web app at increasing client concurrency.
+
+    python -m lagransala serve
+    python benchmarks/bench_web.py --path /events/ --concurrency 1,8,32
+    python benchmarks/bench_web.py --path / --vary-window
+
+`--vary-window` gives every request a different `to` so responses miss the
+in-memory response cache and every request queries SQLite.
+"""
+
+import asyncio
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+import aiohttp
+import typer
+from typing_extensions import Annotated
+
+cli = typer.Typer()
+
+
+# Windows already requested are cached by the app until the next extraction,
+# so every run and every concurrency level asks for new ones
+SALT = random.randrange(1_000_000)
+
+
+async def load(
+    url: str,
+    path: str,
+    concurrency: int,
+    requests: int,
+    vary_window: bool,
+    days: int = 30,
+    first: int = 0,
+) -> tuple[float, list[float], int]:
+    since = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    latencies: list[float] = []
+    errors = 0
+    counter = iter(range(first, first + requests))
+
+    async def client(session: aiohttp.ClientSession) -> None:
+        nonlocal errors
+        for i in counter:
+            params = {}
+            if vary_window:
+                to = since + timedelta(days=days, seconds=i, microseconds=SALT)
+                params = {"since": since.isoformat(), "to": to.isoformat()}
+            start = time.perf_counter()
+            async with session.get(f"{url}{path}", params=params) as response:
+                await response.read()
+                if response.status != 200:
+                    errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return elapsed, latencies, errors
+
+
+@cli.command()
+def run(
+    url: Annotated[str, typer.Option()] = "http://localhost:8000",
+    path: Annotated[str, typer.Option()] = "/events/",
+    concurrency: Annotated[str, typer.Option(help="Comma separated")] = "1,4,16,64",
+    requests: Annotated[int, typer.Option()] = 500,
+    vary_window: Annotated[bool, typer.Option()] = False,
+    days: Annotated[int, typer.Option(help="Window length with --vary-window")] = 30,
+):
+    for level, clients in enumerate(map(int, concurrency.split(","))):
+        elapsed, latencies, errors = asyncio.run(
+            load(url, path, clients, requests, vary_window, days, level * requests)
+        )
+        quantiles = statistics.quantiles(latencies, n=100)
+        print(
+            f"{clients:>4} clients: {len(latencies) / elapsed:8.1f} req/s, "
+            f"p50 {quantiles[49] * 1000:7.2f}ms, "
+            f"p95 {quantiles[94] * 1000:7.2f}ms, "
+            f"{errors} errors"
+        )
+
+
+if __name__ == "__main__":
+    cli()
@@ -1,13 +1,33 @@
 import asyncio
+from datetime import timedelta
+from pathlib import Path
 
 import typer
 from sqlmodel import Session, select
 from typing_extensions import Annotated
 
-from .deps import initialize_sqlmodel
-from .models import Venue
+from .cache import SHARED_STAGES, CacheStage
+from .deps import initialize_cache, initialize_sqlmodel
+from .models import EventDateTime, Occurrence, Venue
+from .scraping.batch import DEFAULT_POLL_INTERVAL
+from .scraping.cpu_pool import DEFAULT_CPU_WORKERS
+from .scraping.parsers import DEFAULT_PARSER
+from .scraping.pipeline import (
+    DEFAULT_EXTRACT_WORKERS,
+    DEFAULT_PARSE_WORKERS,
+    DEFAULT_QUEUE_SIZE,
+)
+from .scraping.scheduler import (
+    DEFAULT_BUDGET,
+    DEFAULT_INTERVAL_MINUTES,
+    DEFAULT_WORKERS,
+)
 
 cli = typer.Typer()
+cache_cli = typer.Typer(help="Inspect and purge the scraping caches")
+cli.add_typer(cache_cli, name="cache")
+db_cli = typer.Typer(help="Migrate and inspect the database")
+cli.add_typer(db_cli, name="db")
 
 
 @cli.command()
@@ -34,7 +54,30 @@ def list_venues():
 
 
 @cli.command()
-def extract(venue_slug: Annotated[str | None, typer.Argument()] = None):
+def extract(
+    venue_slug: Annotated[str | None, typer.Argument()] = None,
+    parser: Annotated[str, typer.Option(help="HTML parser backend")] = DEFAULT_PARSER,
+    workers: Annotated[
+        int, typer.Option(help="Pages fetched at once across all venues")
+    ] = DEFAULT_WORKERS,
+    parse_workers: Annotated[int, typer.Option()] = DEFAULT_PARSE_WORKERS,
+    extract_workers: Annotated[int, typer.Option()] = DEFAULT_EXTRACT_WORKERS,
+    queue_size: Annotated[
+        int, typer.Option(help="Urls waiting before each pipeline stage")
+    ] = DEFAULT_QUEUE_SIZE,
+    cpu_workers: Annotated[
+        int, typer.Option(help="Processes parsing pages, 0 parses inline")
+    ] = DEFAULT_CPU_WORKERS,
+    refresh: Annotated[
+        bool, typer.Option(help="Extract stored upcoming events whose page changed")
+    ] = False,
+    batch: Annotated[
+        bool, typer.Option(help="Extract uncached pages in one LLM batch job")
+    ] = False,
+    poll_interval: Annotated[
+        float, typer.Option(help="Seconds between batch job status checks")
+    ] = DEFAULT_POLL_INTERVAL,
+):
     from .scraping.app import main
 
     engine = initialize_sqlmodel()
@@ -45,9 +88,175 @@ def extract(venue_slug: Annotated[str | None, typer.Argument()] = None):
             if venue is None:
                 raise ValueError(f"Venue with slug {venue_slug} not found")
         print(f"Extracting events from {venue.name}")
-        asyncio.run(main([venue_slug]))
+        venue_slugs = [venue_slug]
     else:
-        asyncio.run(main())
+        venue_slugs = None
+    asyncio.run(
+        main(
+            venue_slugs,
+            parser_name=parser,
+            workers=workers,
+            parse_workers=parse_workers,
+            extract_workers=extract_workers,
+            queue_size=queue_size,
+            cpu_workers=cpu_workers,
+            refresh=refresh,
+            batch=batch,
+            poll_interval=poll_interval,
+        )
+    )
+
+
+@cli.command()
+def retry(
+    venue_slug: Annotated[str | None, typer.Argument()] = None,
+    parser: Annotated[str, typer.Option(help="HTML parser backend")] = DEFAULT_PARSER,
+    cpu_workers: Annotated[
+        int, typer.Option(help="Processes parsing pages, 0 parses inline")
+    ] = DEFAULT_CPU_WORKERS,
+):
+    """Extract again the urls that failed transiently, once their backoff is over."""
+    from .scraping.app import main
+
+    asyncio.run(
+        main(
+            [venue_slug] if venue_slug is not None else None,
+            parser_name=parser,
+            cpu_workers=cpu_workers,
+            retry=True,
+        )
+    )
+
+
+@cli.command()
+def crawl(
+    venue_slug: Annotated[str | None, typer.Argument()] = None,
+    daemon: Annotated[bool, typer.Option(help="Keep recrawling due pages")] = False,
+    budget: Annotated[
+        int, typer.Option(help="Most pages fetched per run")
+    ] = DEFAULT_BUDGET,
+    interval: Annotated[
+        int, typer.Option(help="Minutes between daemon runs")
+    ] = DEFAULT_INTERVAL_MINUTES,
+    parser: Annotated[str, typer.Option(help="HTML parser backend")] = DEFAULT_PARSER,
+    cpu_workers: Annotated[
+        int, typer.Option(help="Processes parsing pages, 0 parses inline")
+    ] = DEFAULT_CPU_WORKERS,
+):
+    """Fetch the listing and event pages most likely to have changed."""
+    from .scraping.crawler import main
+
+    asyncio.run(
+        main(
+            [venue_slug] if venue_slug is not None else None,
+            daemon=daemon,
+            budget=budget,
+            interval=timedelta(minutes=interval),
+            parser_name=parser,
+            cpu_workers=cpu_workers,
+        )
+    )
+
+
+@cli.command()
+def build_site(
+    output: Annotated[Path, typer.Option()] = Path("site"),
+    days: Annotated[int, typer.Option(help="Days ahead to publish")] = 90,
+    force: Annotated[bool, typer.Option(help="Render every page")] = False,
+):
+    from .utils.calendar_window import month_end, today
+    from .web.models import PublicScheduledEvent
+    from .web.site import SiteBuilder, calendar_pages, event_pages
+
+    engine = initialize_sqlmodel()
+    since = today()
+    until = since + timedelta(days=days)
+    with Session(engine) as db_session:
+        occurrences = Occurrence.get_calendar(db_session, since, until)
+        rows = EventDateTime.get_scheduled_in_interval(db_session, since, until)
+    public_events = [PublicScheduledEvent.from_row(row) for row in rows]
+    pages = calendar_pages(occurrences, since, month_end()) + event_pages(public_events)
+    stats = SiteBuilder(output).build(pages, force=force)
+    print(
+        f"{stats.rendered} pages rendered, {stats.unchanged} unchanged, "
+        f"{stats.removed} removed"
+    )
+
+
+@cache_cli.command("stats")
+def cache_stats(venue_slug: Annotated[str | None, typer.Option("--venue")] = None):
+    async def stats():
+        cache = initialize_cache()
+        info = await cache.redis.info("memory")
+        print(
+            f"used_memory: {info['used_memory_human']} "
+            f"maxmemory_policy: {info['maxmemory_policy']}"
+        )
+        for stage in CacheStage:
+            stage_stats = await cache.stage_stats(stage, venue_slug)
+            version = await cache.version(stage)
+            ratio = stage_stats.hit_ratio
+            print(
+                f"{stage.value} (v{version}): {stage_stats.keys} keys, "
+                f"{stage_stats.memory / 1024:.1f} KiB, "
+                f"{stage_stats.hits} hits, {stage_stats.misses} misses, "
+                f"hit ratio {'-' if ratio is None else f'{ratio:.1%}'}"
+            )
+        await cache.close()
+
+    asyncio.run(stats())
+
+
+@cache_cli.command("purge")
+def cache_purge(
+    venue_slug: Annotated[str | None, typer.Option("--venue")] = None,
+    stage: Annotated[CacheStage | None, typer.Option("--stage")] = None,
+):
+    if venue_slug is None and stage is None:
+        raise typer.BadParameter("Either --venue or --stage is required")
+
+    async def purge():
+        cache = initialize_cache()
+        for purged_stage in [stage] if stage is not None else CacheStage:
+            if venue_slug is not None and purged_stage in SHARED_STAGES:
+                print(f"{purged_stage.value}: shared by all venues, skipped")
+                continue
+            deleted = await cache.purge(purged_stage, venue_slug)
+            print(f"{purged_stage.value}: deleted {deleted} keys")
+        await cache.close()
+
+    asyncio.run(purge())
+
+
+@cache_cli.command("bump")
+def cache_bump(stage: CacheStage):
+    async def bump():
+        cache = initialize_cache()
+        version = await cache.bump_version(stage)
+        print(f"{stage.value}: now at v{version}")
+        await cache.close()
+
+    asyncio.run(bump())
+
+
+@db_cli.command("migrate")
+def db_migrate():
+    from .db import schema_version
+
+    # Pending migrations run when the engine is created
+    engine = initialize_sqlmodel()
+    print(f"Database at schema version {schema_version(engine)}")
+
+
+@db_cli.command("analyze")
+def db_analyze():
+    from .db import explain, hot_queries
+
+    engine = initialize_sqlmodel()
+    for name, query in hot_queries().items():
+        print(f"{name}:")
+        for line in explain(engine, query):
+            print(f"  {line}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,227 @@
+import logging
+from collections import Counter
+from datetime import timedelta
+from enum import Enum
+from typing import Iterable, Mapping
+
+from pydantic import BaseModel
+from redis.asyncio import BlockingConnectionPool, Redis
+
+logger = logging.getLogger(__name__)
+
+CacheValue = str | bytes
+
+
+class CacheStage(Enum):
+    SCHEDULE = "schedule_scraper"
+    CONTENT_BLOCKS = "content_blocks_scraper"
+    EXTRACTION = "event_data_extractor"
+    HTTP_VALIDATORS = "http_validators"
+
+
+class StagePolicy(BaseModel):
+    ttl: timedelta | None
+
+
+DEFAULT_POLICIES: dict[CacheStage, StagePolicy] = {
+    CacheStage.SCHEDULE: StagePolicy(ttl=timedelta(hours=6)),
+    CacheStage.CONTENT_BLOCKS: StagePolicy(ttl=timedelta(days=7)),
+    CacheStage.EXTRACTION: StagePolicy(ttl=timedelta(days=90)),
+    CacheStage.HTTP_VALIDATORS: StagePolicy(ttl=timedelta(days=30)),
+}
+
+# Stages keyed by content alone, one venue reuses another's entries
+SHARED_STAGES = {CacheStage.EXTRACTION}
+
+VERSION_KEY = "cache_version"
+STATS_KEY = "cache_stats"
+# Bumped every time extracted events are committed, readers key their
+# response caches on it
+DATA_VERSION_KEY = "data_version"
+
+
+class CacheStageStats(BaseModel):
+    stage: CacheStage
+    keys: int
+    memory: int
+    hits: int
+    misses: int
+
+    @property
+    def hit_ratio(self) -> float | None:
+        total = self.hits + self.misses
+        return self.hits / total if total else None
+
+
+def stage_pattern(stage: CacheStage, venue: str | None = None) -> str | None:
+    if venue is None:
+        return f"{stage.value}:*"
+    if stage in SHARED_STAGES:
+        # Nothing in a shared key tells which venue it came from
+        return None
+    return f"{stage.value}:v*:{venue}:*"
+
+
+class Cache:
+    def __init__(self, redis: Redis) -> None:
+        self.redis = redis
+        self.stats: Counter[tuple[CacheStage, str]] = Counter()
+
+    @classmethod
+    def from_url(
+        cls, url: str, max_connections: int = 32, timeout: float = 20
+    ) -> "Cache":
+        # Commands beyond `max_connections` wait for a free connection instead
+        # of failing, scrapers issue one per page all at once
+        pool = BlockingConnectionPool.from_url(
+            url,
+            max_connections=max_connections,
+            timeout=timeout,
+            decode_responses=True,
+        )
+        return cls(Redis(connection_pool=pool))
+
+    async def get(self, key: str) -> str | None:
+        return await self.redis.get(key)
+
+    async def set(
+        self, key: str, value: CacheValue, ex: int | timedelta | None = None
+    ) -> None:
+        await self.redis.set(key, value, ex=ex)
+
+    async def get_many(self, keys: Iterable[str]) -> dict[str, str | None]:
+        keys = list(keys)
+        if not keys:
+            return {}
+        values = await self.redis.mget(keys)
+        return dict(zip(keys, values))
+
+    async def set_many(
+        self, items: Mapping[str, CacheValue], ex: int | timedelta | None = None
+    ) -> None:
+        if not items:
+            return
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key, value in items.items():
+                pipe.set(key, value, ex=ex)
+            await pipe.execute()
+
+    async def delete(self, *keys: str) -> int:
+        if not keys:
+            return 0
+        return await self.redis.delete(*keys)
+
+    async def scan_keys(self, pattern: str) -> list[str]:
+        return [key async for key in self.redis.scan_iter(match=pattern, count=1000)]
+
+    async def version(self, stage: CacheStage) -> int:
+        return int(await self.redis.hget(VERSION_KEY, stage.value) or 1)
+
+    async def bump_version(self, stage: CacheStage) -> int:
+        version = await self.version(stage) + 1
+        await self.redis.hset(VERSION_KEY, stage.value, str(version))
+        return version
+
+    async def data_version(self) -> int:
+        return int(await self.redis.get(DATA_VERSION_KEY) or 0)
+
+    async def bump_data_version(self) -> int:
+        return await self.redis.incr(DATA_VERSION_KEY)
+
+    async def namespace(
+        self, stage: CacheStage, venue: str, ttl: timedelta | None = None
+    ) -> "CacheNamespace":
+        policy = DEFAULT_POLICIES[stage]
+        return CacheNamespace(
+            self,
+            stage,
+            await self.version(stage),
+            None if stage in SHARED_STAGES else venue,
+            ttl if ttl is not None else policy.ttl,
+        )
+
+    async def stage_stats(
+        self, stage: CacheStage, venue: str | None = None
+    ) -> CacheStageStats:
+        pattern = stage_pattern(stage, venue)
+        keys = await self.scan_keys(pattern) if pattern is not None else []
+        memory = 0
+        for i in range(0, len(keys), 1000):
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key in keys[i : i + 1000]:
+                    pipe.memory_usage(key)
+                memory += sum(usage or 0 for usage in await pipe.execute())
+        counters = await self.redis.hgetall(f"{STATS_KEY}:{stage.value}")
+        return CacheStageStats(
+            stage=stage,
+            keys=len(keys),
+            memory=memory,
+            hits=int(counters.get("hits", 0)),
+            misses=int(counters.get("misses", 0)),
+        )
+
+    async def purge(self, stage: CacheStage, venue: str | None = None) -> int:
+        pattern = stage_pattern(stage, venue)
+        keys = await self.scan_keys(pattern) if pattern is not None else []
+        deleted = 0
+        for i in range(0, len(keys), 1000):
+            deleted += await self.redis.unlink(*keys[i : i + 1000])
+        if venue is None:
+            await self.redis.delete(f"{STATS_KEY}:{stage.value}")
+        return deleted
+
+    def record(self, stage: CacheStage, hits: int, misses: int) -> None:
+        self.stats[(stage, "hits")] += hits
+        self.stats[(stage, "misses")] += misses
+
+    async def flush_stats(self) -> None:
+        if not self.stats:
+            return
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for (stage, field), count in self.stats.items():
+                pipe.hincrby(f"{STATS_KEY}:{stage.value}", field, count)
+            await pipe.execute()
+        self.stats.clear()
+
+    async def close(self) -> None:
+        await self.flush_stats()
+        await self.redis.aclose()
+        await self.redis.connection_pool.disconnect()
+
+
+class CacheNamespace:
+    def __init__(
+        self,
+        cache: Cache,
+        stage: CacheStage,
+        version: int,
+        venue: str | None,
+        ttl: timedelta | None,
+    ) -> None:
+        self.cache = cache
+        self.stage = stage
+        self.version = version
+        self.venue = venue
+        self.ttl = ttl
+
+    def key(self, suffix: str) -> str:
+        if self.venue is None:
+            return f"{self.stage.value}:v{self.version}:{suffix}"
+        return f"{self.stage.value}:v{self.version}:{self.venue}:{suffix}"
+
+    async def get(self, key: str) -> str | None:
+        data = await self.cache.get(key)
+        self.cache.record(self.stage, int(bool(data)), int(not data))
+        return data
+
+    async def get_many(self, keys: Iterable[str]) -> dict[str, str | None]:
+        result = await self.cache.get_many(keys)
+        hits = sum(1 for data in result.values() if data)
+        self.cache.record(self.stage, hits, len(result) - hits)
+        return result
+
+    async def set(self, key: str, value: CacheValue) -> None:
+        await self.cache.set(key, value, ex=self.ttl)
+
+    async def set_many(self, items: Mapping[str, CacheValue]) -> None:
+        await self.cache.set_many(items, ex=self.ttl)
@@ -0,0 +1,50 @@
+import re
+from functools import lru_cache
+from typing import Iterable
+
+from markdownify import MarkdownConverter
+
+_BLANK_LINES = re.compile(r"\n\s*\n\s*\n")
+
+
+class CleaningPipeline:
+    def __init__(self, remove_regex: Iterable[str], strip_elements: Iterable[str]):
+        self.remove_regex = [re.compile(regex) for regex in remove_regex]
+        self.converter = MarkdownConverter(
+            strip=["script", "style", *strip_elements],
+            heading_style="ATX",
+            bullets="-",
+        )
+
+    def markdown(self, html: str) -> str:
+        return self.converter.convert(html)
+
+    def clean(self, markdown: str) -> str | None:
+        content = markdown
+        for regex in self.remove_regex:
+            if not content:
+                return None
+            content = regex.sub("", content)
+        if not content:
+            return None
+        content = _BLANK_LINES.sub("\n\n", content)
+        content = "\n".join(line.rstrip() for line in content.splitlines())
+        content = content.strip() + "\n"
+        return None if content == "\n" else content
+
+    def __call__(self, content: str | None, is_markdown: bool = False) -> str | None:
+        if content is None:
+            return None
+        return self.clean(content if is_markdown else self.markdown(content))
+
+    def many(
+        self, contents: Iterable[str | None], is_markdown: bool = False
+    ) -> list[str | None]:
+        return [self(content, is_markdown) for content in contents]
+
+
+@lru_cache(maxsize=None)
+def compile_pipeline(
+    remove_regex: tuple[str, ...], strip_elements: tuple[str, ...]
+) -> CleaningPipeline:
+    return CleaningPipeline(remove_regex, strip_elements)
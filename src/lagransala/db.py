@@ -0,0 +1,230 @@
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Callable
+from uuid import UUID
+
+from pydantic import HttpUrl
+from sqlalchemy import Connection, Engine, insert
+from sqlalchemy.sql import Select
+from sqlmodel import SQLModel, select
+
+from .models import (
+    CrawlState,
+    Event,
+    EventDateTime,
+    Occurrence,
+    PageKind,
+    Venue,
+    VenueSpec,
+)
+
+logger = logging.getLogger(__name__)
+
+Migration = Callable[[Connection], None]
+
+
+def _columns(connection: Connection, table: str) -> set[str]:
+    return {row[1] for row in connection.exec_driver_sql(f"PRAGMA table_info({table})")}
+
+
+def _add_columns(connection: Connection, table: str, columns: dict[str, str]) -> None:
+    existing = _columns(connection, table)
+    for column, sql_type in columns.items():
+        if column not in existing:
+            connection.exec_driver_sql(
+                f"ALTER TABLE {table} ADD COLUMN {column} {sql_type}"
+            )
+
+
+def _add_venue_spec_limits(connection: Connection) -> None:
+    _add_columns(
+        connection,
+        "venuespec",
+        {"max_concurrency": "INTEGER", "requests_per_second": "FLOAT"},
+    )
+
+
+def _add_venue_spec_cache_ttls(connection: Connection) -> None:
+    _add_columns(
+        connection,
+        "venuespec",
+        {
+            "schedule_cache_ttl": "INTEGER",
+            "content_blocks_cache_ttl": "INTEGER",
+            "extraction_cache_ttl": "INTEGER",
+        },
+    )
+
+
+def _add_venue_spec_max_page_bytes(connection: Connection) -> None:
+    _add_columns(connection, "venuespec", {"max_page_bytes": "INTEGER"})
+
+
+def _add_indexes(connection: Connection) -> None:
+    # Older databases may hold the same url more than once, keep the first
+    # event so the unique index can be built
+    duplicates = (
+        "SELECT id FROM event WHERE rowid NOT IN "
+        "(SELECT MIN(rowid) FROM event GROUP BY url)"
+    )
+    connection.exec_driver_sql(
+        f"DELETE FROM eventdatetime WHERE event_id IN ({duplicates})"
+    )
+    deleted = connection.exec_driver_sql(
+        f"DELETE FROM event WHERE id IN ({duplicates})"
+    ).rowcount
+    if deleted:
+        logger.warning(f"Deleted {deleted} events with a duplicated url")
+    for statement in [
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_event_url ON event (url)",
+        "CREATE INDEX IF NOT EXISTS ix_event_venue_id ON event (venue_id)",
+        "CREATE INDEX IF NOT EXISTS ix_eventdatetime_event_id "
+        "ON eventdatetime (event_id)",
+        "CREATE INDEX IF NOT EXISTS ix_eventdatetime_datetime_event_id "
+        "ON eventdatetime (datetime, event_id)",
+        "CREATE INDEX IF NOT EXISTS ix_venuespec_venue_id ON venuespec (venue_id)",
+    ]:
+        connection.exec_driver_sql(statement)
+
+
+def _unique_occurrences(connection: Connection) -> None:
+    connection.exec_driver_sql(
+        "DELETE FROM eventdatetime WHERE rowid NOT IN "
+        "(SELECT MIN(rowid) FROM eventdatetime GROUP BY datetime, event_id)"
+    )
+    connection.exec_driver_sql(
+        "DROP INDEX IF EXISTS ix_eventdatetime_datetime_event_id"
+    )
+    connection.exec_driver_sql(
+        "CREATE UNIQUE INDEX ix_eventdatetime_datetime_event_id "
+        "ON eventdatetime (datetime, event_id)"
+    )
+
+
+def _backfill_occurrences(connection: Connection) -> None:
+    query = (
+        select(
+            EventDateTime.id,
+            EventDateTime.datetime,
+            Event.id.label("event_id"),  # type: ignore[attr-defined]
+            Event.title,
+            Event.author,
+            Event.description,
+            Event.duration,
+            Event.url,
+            Venue.slug,
+            Venue.name,
+        )
+        .join(Event, EventDateTime.event_id == Event.id)  # type: ignore[arg-type]
+        .join(Venue, Event.venue_id == Venue.id)  # type: ignore[arg-type]
+        .where(
+            EventDateTime.id.not_in(select(Occurrence.id))  # type: ignore[attr-defined]
+        )
+    )
+    for rows in connection.execute(query).partitions(1000):
+        connection.execute(
+            insert(Occurrence),
+            [
+                Occurrence.values(
+                    Event(
+                        id=row.event_id,
+                        title=row.title,
+                        author=row.author,
+                        description=row.description,
+                        duration=row.duration,
+                        url=row.url,
+                    ),
+                    EventDateTime(id=row.id, datetime=row.datetime),
+                    row.slug,
+                    row.name,
+                )
+                for row in rows
+            ],
+        )
+
+
+def _add_event_content_hash(connection: Connection) -> None:
+    # Existing events get their hash on the first refresh that extracts them
+    if "content_hash" not in _columns(connection, "event"):
+        connection.exec_driver_sql("ALTER TABLE event ADD COLUMN content_hash VARCHAR")
+
+
+def _add_crawl_state_failures(connection: Connection) -> None:
+    _add_columns(connection, "crawlstate", {"failures": "INTEGER NOT NULL DEFAULT 0"})
+
+
+# Append only: a database at `PRAGMA user_version` N has applied the first N.
+# Migrations must be idempotent, a new database gets the full schema from
+# `create_all` and then runs every migration. They run against the schema of
+# their own version, not the current models: select and write explicit columns
+# (or raw SQL), never whole models, as later migrations may add columns.
+MIGRATIONS: list[Migration] = [
+    _add_venue_spec_limits,
+    _add_venue_spec_cache_ttls,
+    _add_venue_spec_max_page_bytes,
+    _add_indexes,
+    _unique_occurrences,
+    _backfill_occurrences,
+    _add_event_content_hash,
+    _add_crawl_state_failures,
+]
+
+
+def schema_version(engine: Engine) -> int:
+    with engine.connect() as connection:
+        return connection.exec_driver_sql("PRAGMA user_version").scalar() or 0
+
+
+def migrate(engine: Engine) -> list[str]:
+    SQLModel.metadata.create_all(engine)
+    applied: list[str] = []
+    with engine.begin() as connection:
+        version = connection.exec_driver_sql("PRAGMA user_version").scalar() or 0
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            logger.info(f"Applying migration {number}: {migration.__name__}")
+            migration(connection)
+            connection.exec_driver_sql(f"PRAGMA user_version = {number}")
+            applied.append(migration.__name__)
+        if applied:
+            connection.exec_driver_sql("ANALYZE")
+    return applied
+
+
+def hot_queries() -> dict[str, Select]:
+    since = datetime.now(timezone.utc)
+    to = since + timedelta(days=30)
+    event_id = venue_id = UUID(int=0)
+    return {
+        "scheduled events": EventDateTime.scheduled_in_interval_query(since, to),
+        "scheduled events page": EventDateTime.scheduled_in_interval_query(
+            since, to, (since, event_id), 100
+        ),
+        "calendar": Occurrence.calendar_query(since, to),
+        "event schedule": select(EventDateTime).where(
+            EventDateTime.event_id == event_id
+        ),
+        "known urls": select(Event.url).where(
+            Event.url.in_(  # type: ignore[attr-defined]
+                [HttpUrl("https://example.com/")]
+            )
+        ),
+        "venue urls": select(Event.url).where(Event.venue_id == venue_id),
+        "venue spec": select(VenueSpec).where(VenueSpec.venue_id == venue_id),
+        "due pages": select(CrawlState).where(
+            CrawlState.venue_id == venue_id,
+            CrawlState.kind == PageKind.EVENT,
+            CrawlState.next_fetch_at <= since.replace(tzinfo=None),
+        ),
+    }
+
+
+def explain(engine: Engine, query: Select) -> list[str]:
+    sql = query.compile(engine, compile_kwargs={"literal_binds": True})
+    with engine.connect() as connection:
+        rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}").all()
+    depth: dict[int, int] = {0: -1}
+    plan: list[str] = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        plan.append(f"{'  ' * depth[node_id]}{detail}")
+    return plan
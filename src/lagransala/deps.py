@@ -1,15 +1,30 @@
 import os
 
+import httpx
 import instructor
 from anthropic import AsyncAnthropic
-from groq import AsyncGroq
-from redis import StrictRedis
-from sqlalchemy import Engine
-from sqlmodel import SQLModel, create_engine
+from anthropic import DefaultAsyncHttpxClient as AnthropicAsyncHttpxClient
+from groq import AsyncGroq, DefaultAsyncHttpxClient
+from sqlalchemy import Engine, event
+from sqlmodel import create_engine
+
+from .cache import Cache
+from .db import migrate
+from .scraping.batch import BatchProvider, OpenAIBatchProvider
+from .scraping.llm_concurrency import AdaptiveConcurrencyController, parse_reset
 
 _SQLMODEL: Engine | None = None
 
 
+def _sqlite_pragmas(dbapi_connection, _) -> None:
+    # WAL lets the web app and the scraper's background writer read while
+    # a batch is being committed
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
 def initialize_sqlmodel() -> Engine:
     global _SQLMODEL
     if not _SQLMODEL:
@@ -18,14 +33,66 @@ def initialize_sqlmodel() -> Engine:
             echo=False,
             connect_args={"check_same_thread": False},
         )
-        SQLModel.metadata.create_all(_SQLMODEL)
+        event.listen(_SQLMODEL, "connect", _sqlite_pragmas)
+        migrate(_SQLMODEL)
     return _SQLMODEL
 
 
+_READ_ONLY_SQLMODEL: Engine | None = None
+
+# Connections kept by the read-only engine, also the size of the web app's
+# database thread pool. Rendering rows is CPU bound, more threads mostly
+# fight over the GIL with the event loop
+READ_POOL_SIZE = int(os.getenv("READ_POOL_SIZE", "2"))
+
+
+def _sqlite_read_only_pragmas(dbapi_connection, _) -> None:
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+
+def initialize_read_only_sqlmodel() -> Engine:
+    global _READ_ONLY_SQLMODEL
+    if not _READ_ONLY_SQLMODEL:
+        # Make sure the schema is migrated before handing out read connections
+        initialize_sqlmodel()
+        _READ_ONLY_SQLMODEL = create_engine(
+            "sqlite:///lagransala.db",
+            echo=False,
+            connect_args={"check_same_thread": False},
+            pool_size=READ_POOL_SIZE,
+            max_overflow=0,
+        )
+        event.listen(_READ_ONLY_SQLMODEL, "connect", _sqlite_pragmas)
+        event.listen(_READ_ONLY_SQLMODEL, "connect", _sqlite_read_only_pragmas)
+    return _READ_ONLY_SQLMODEL
+
+
 _INSTRUCTOR: instructor.AsyncInstructor | None = None
 
 INSTRUCTOR_MODEL = "deepseek-r1-distill-llama-70b"
 
+_LLM_CONCURRENCY: AdaptiveConcurrencyController | None = None
+
+
+def initialize_llm_concurrency() -> AdaptiveConcurrencyController:
+    global _LLM_CONCURRENCY
+    if not _LLM_CONCURRENCY:
+        _LLM_CONCURRENCY = AdaptiveConcurrencyController()
+    return _LLM_CONCURRENCY
+
+
+async def _track_rate_limit_headers(response: httpx.Response) -> None:
+    # The only place a 429 reaches the controller, it sees every response,
+    # the client's own retries included
+    controller = initialize_llm_concurrency()
+    if response.status_code == 429:
+        await controller.on_rate_limited(
+            parse_reset(response.headers.get("retry-after"))
+        )
+    await controller.update_from_headers(response.headers)
+
 
 def initialize_instructor_anthropic() -> instructor.AsyncInstructor:
     global _INSTRUCTOR
@@ -36,7 +103,12 @@ def initialize_instructor_anthropic() -> instructor.AsyncInstructor:
         ), "No se ha encontrado la variable de entorno ANTHROPIC_API_KEY"
 
         _INSTRUCTOR = instructor.from_anthropic(
-            AsyncAnthropic(api_key=anthropic_api_key)
+            AsyncAnthropic(
+                api_key=anthropic_api_key,
+                http_client=AnthropicAsyncHttpxClient(
+                    event_hooks={"response": [_track_rate_limit_headers]}
+                ),
+            )
         )
     return _INSTRUCTOR
 
@@ -49,16 +121,39 @@ def initialize_instructor_groq() -> instructor.AsyncInstructor:
             groq_api_key
         ), "No se ha encontrado la variable de entorno ANTHROPIC_API_KEY"
         _INSTRUCTOR = instructor.from_groq(
-            AsyncGroq(api_key=groq_api_key), mode=instructor.Mode.TOOLS
+            AsyncGroq(
+                api_key=groq_api_key,
+                http_client=DefaultAsyncHttpxClient(
+                    event_hooks={"response": [_track_rate_limit_headers]}
+                ),
+            ),
+            mode=instructor.Mode.TOOLS,
         )
     return _INSTRUCTOR
 
 
-_REDIS: StrictRedis | None = None
+_CACHE: Cache | None = None
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+
+def initialize_cache() -> Cache:
+    global _CACHE
+    if not _CACHE:
+        _CACHE = Cache.from_url(REDIS_URL)
+    return _CACHE
+
+
+_BATCH_PROVIDER: BatchProvider | None = None
+
+# Any OpenAI compatible batch API, Groq's by default
+LLM_BATCH_BASE_URL = os.getenv("LLM_BATCH_BASE_URL", "https://api.groq.com/openai/v1")
 
 
-def initialize_redis() -> StrictRedis:
-    global _REDIS
-    if not _REDIS:
-        _REDIS = StrictRedis(host="localhost", decode_responses=True)
-    return _REDIS
+def initialize_batch_provider() -> BatchProvider:
+    global _BATCH_PROVIDER
+    if not _BATCH_PROVIDER:
+        api_key = os.getenv("LLM_BATCH_API_KEY") or os.getenv("GROQ_API_KEY")
+        assert api_key, "No se ha encontrado la variable de entorno GROQ_API_KEY"
+        _BATCH_PROVIDER = OpenAIBatchProvider(LLM_BATCH_BASE_URL, api_key)
+    return _BATCH_PROVIDER
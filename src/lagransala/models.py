@@ -1,19 +1,21 @@
 import logging
-import re
 from abc import ABC, abstractmethod
 from datetime import datetime, timedelta
 from enum import Enum
 from pathlib import Path
-from typing import Self, Sequence
+from typing import Iterable, Self, Sequence
 from uuid import UUID, uuid4
 
 import pydantic
 import yaml
-from markdownify import markdownify
 from pydantic import AwareDatetime, BaseModel, HttpUrl, field_validator, model_validator
+from sqlalchemy import Index, Row, tuple_
 from sqlmodel import Field, Relationship, Session, SQLModel, select
 
+from .cache import CacheStage
+from .cleaning import CleaningPipeline, compile_pipeline
 from .utils.build_sqlmodel_type import build_sqlmodel_list_type, build_sqlmodel_type
+from .utils.calendar_window import calendar_labels
 
 logger = logging.getLogger(__name__)
 
@@ -50,14 +52,16 @@ class Venue(SQLModel, table=True):
 class Event(SQLModel, table=True):
     id: UUID = Field(default_factory=uuid4, primary_key=True)
     schedule: list["EventDateTime"] = Relationship(back_populates="event")
-    venue_id: UUID = Field(default=None, foreign_key="venue.id")
+    venue_id: UUID = Field(default=None, foreign_key="venue.id", index=True)
     venue: Venue = Relationship(back_populates="events")
 
-    url: HttpUrl = Field(sa_type=build_sqlmodel_type(HttpUrl))
+    url: HttpUrl = Field(sa_type=build_sqlmodel_type(HttpUrl), unique=True, index=True)
     title: str
     author: str | None
     description: str
     duration: timedelta | None
+    # Hash of the content blocks the event was extracted from
+    content_hash: str | None = None
 
     @classmethod
     def get_events_in_interval(
@@ -74,18 +78,255 @@ class Event(SQLModel, table=True):
         return session.exec(query).all()
 
     @classmethod
-    def get_urls(cls, session: Session) -> set[HttpUrl]:
-        return set(map(lambda event: event.url, session.exec(select(Event)).all()))
+    def get_urls(cls, session: Session, venue_id: UUID | None = None) -> set[HttpUrl]:
+        query = select(Event.url)
+        if venue_id is not None:
+            query = query.where(Event.venue_id == venue_id)
+        return set(session.exec(query).all())
+
+    @classmethod
+    def upcoming_hashes(
+        cls, session: Session, venue_id: UUID, since: datetime
+    ) -> dict[HttpUrl, str | None]:
+        # Content hash of the venue's events with an occurrence after `since`
+        query = (
+            select(Event.url, Event.content_hash)
+            .where(Event.venue_id == venue_id)
+            .where(
+                select(EventDateTime.id)
+                .where(EventDateTime.event_id == Event.id)
+                .where(EventDateTime.datetime >= since)
+                .exists()
+            )
+        )
+        return {url: content_hash for url, content_hash in session.exec(query).all()}
+
+    @classmethod
+    def known_urls(
+        cls, session: Session, urls: Iterable[HttpUrl], batch_size: int = 500
+    ) -> set[HttpUrl]:
+        urls = list(urls)
+        known: set[HttpUrl] = set()
+        for i in range(0, len(urls), batch_size):
+            query = select(Event.url).where(
+                Event.url.in_(urls[i : i + batch_size])  # type: ignore[attr-defined]
+            )
+            known.update(session.exec(query).all())
+        return known
 
 
 class EventDateTime(SQLModel, table=True):
+    __table_args__ = (
+        # Unique so (datetime, event_id) is a total order for keyset pagination
+        Index(
+            "ix_eventdatetime_datetime_event_id", "datetime", "event_id", unique=True
+        ),
+    )
+
     id: UUID = Field(default_factory=uuid4, primary_key=True)
 
-    event_id: UUID = Field(default=None, foreign_key="event.id")
+    event_id: UUID = Field(default=None, foreign_key="event.id", index=True)
     event: Event = Relationship(back_populates="schedule")
 
     datetime: datetime  # TODO: validate aware datetime
 
+    @classmethod
+    def scheduled_in_interval_query(
+        cls,
+        start: AwareDatetime,
+        end: AwareDatetime,
+        after: tuple[datetime, UUID] | None = None,
+        limit: int | None = None,
+    ):
+        # One row per occurrence with only the columns the calendar renders,
+        # walking the (datetime, event_id) index in order. `after` is the
+        # keyset of the last row already seen.
+        query = (
+            select(
+                EventDateTime.datetime,
+                Event.id,
+                Event.title,
+                Event.description,
+                Event.duration,
+                Event.url,
+                Venue.slug.label("venue_slug"),  # type: ignore[attr-defined]
+                Venue.name.label("venue_name"),  # type: ignore[attr-defined]
+            )
+            .join(Event, EventDateTime.event_id == Event.id)  # type: ignore[arg-type]
+            .join(Venue, Event.venue_id == Venue.id)  # type: ignore[arg-type]
+            .order_by(EventDateTime.datetime, EventDateTime.event_id)
+        )
+        if after is not None:
+            # SQLite seeks with the first lower bound it finds, keep the
+            # keyset ahead of the interval start
+            query = query.where(
+                tuple_(EventDateTime.datetime, EventDateTime.event_id) > after
+            )
+        query = query.where(EventDateTime.datetime >= start).where(
+            EventDateTime.datetime <= end
+        )
+        if limit is not None:
+            query = query.limit(limit)
+        return query
+
+    @classmethod
+    def get_scheduled_in_interval(
+        cls,
+        session: Session,
+        start: AwareDatetime,
+        end: AwareDatetime,
+        after: tuple[datetime, UUID] | None = None,
+        limit: int | None = None,
+    ) -> Sequence[Row]:
+        return session.exec(
+            cls.scheduled_in_interval_query(start, end, after, limit)
+        ).all()
+
+
+SHORT_DESCRIPTION_LENGTH = 280
+
+
+def short_description(description: str) -> str:
+    if len(description) <= SHORT_DESCRIPTION_LENGTH:
+        return description
+    cut = description[:SHORT_DESCRIPTION_LENGTH].rsplit(maxsplit=1)[0]
+    return cut.rstrip(",.;:") + "…"
+
+
+class Occurrence(SQLModel, table=True):
+    # Denormalized copy of every EventDateTime with what the calendar renders,
+    # labels included. Written by the EventWriter alongside the events.
+    __table_args__ = (
+        Index("ix_occurrence_datetime_event_id", "datetime", "event_id", unique=True),
+    )
+
+    id: UUID = Field(primary_key=True, foreign_key="eventdatetime.id")
+    event_id: UUID = Field(foreign_key="event.id", index=True)
+    datetime: datetime
+    month_label: str
+    day_label: str
+    venue_slug: str
+    venue_name: str
+    title: str
+    author: str | None
+    short_description: str
+    duration: timedelta | None
+    url: HttpUrl = Field(sa_type=build_sqlmodel_type(HttpUrl))
+
+    @classmethod
+    def values(
+        cls,
+        event: Event,
+        event_datetime: EventDateTime,
+        venue_slug: str,
+        venue_name: str,
+    ) -> dict:
+        month_label, day_label = calendar_labels(event_datetime.datetime)
+        return {
+            "id": event_datetime.id,
+            "event_id": event.id,
+            "datetime": event_datetime.datetime,
+            "month_label": month_label,
+            "day_label": day_label,
+            "venue_slug": venue_slug,
+            "venue_name": venue_name,
+            "title": event.title,
+            "author": event.author,
+            "short_description": short_description(event.description),
+            "duration": event.duration,
+            "url": event.url,
+        }
+
+    @classmethod
+    def calendar_query(cls, start: AwareDatetime, end: AwareDatetime):
+        return (
+            select(
+                Occurrence.datetime,
+                Occurrence.event_id,
+                Occurrence.month_label,
+                Occurrence.day_label,
+                Occurrence.venue_name,
+                Occurrence.title,
+                Occurrence.author,
+                Occurrence.short_description,
+                Occurrence.duration,
+                Occurrence.url,
+            )
+            .where(Occurrence.datetime >= start)
+            .where(Occurrence.datetime <= end)
+            .order_by(Occurrence.datetime, Occurrence.event_id)
+        )
+
+    @classmethod
+    def get_calendar(
+        cls, session: Session, start: AwareDatetime, end: AwareDatetime
+    ) -> Sequence[Row]:
+        return session.exec(cls.calendar_query(start, end)).all()
+
+
+class PageKind(Enum):
+    LISTING = "listing"
+    EVENT = "event"
+
+
+class CrawlState(SQLModel, table=True):
+    # What the recrawl scheduler knows about a listing or event page
+    id: UUID = Field(default_factory=uuid4, primary_key=True)
+    venue_id: UUID = Field(foreign_key="venue.id", index=True)
+    kind: PageKind
+    url: HttpUrl = Field(sa_type=build_sqlmodel_type(HttpUrl), unique=True, index=True)
+
+    content_hash: str | None = None
+    last_fetched_at: datetime | None = None
+    last_changed_at: datetime | None = None
+    next_fetch_at: datetime = Field(index=True)
+
+    # Fetches compared with a previous one, how many of them saw a change and
+    # the seconds between them, what the change rate is estimated from
+    checks: int = 0
+    changes: int = 0
+    observed_seconds: float = 0
+    # Failed fetches in a row, or extractions that produced no event
+    failures: int = 0
+
+    @classmethod
+    def known_urls(
+        cls, session: Session, urls: Iterable[HttpUrl], batch_size: int = 500
+    ) -> set[HttpUrl]:
+        urls = list(urls)
+        known: set[HttpUrl] = set()
+        for i in range(0, len(urls), batch_size):
+            query = select(CrawlState.url).where(
+                CrawlState.url.in_(  # type: ignore[attr-defined]
+                    urls[i : i + batch_size]
+                )
+            )
+            known.update(session.exec(query).all())
+        return known
+
+
+class JobState(Enum):
+    PENDING = "pending"
+    FETCHED = "fetched"
+    EXTRACTED = "extracted"
+    FAILED = "failed"
+
+
+class ExtractionJob(SQLModel, table=True):
+    # Ledger of the event urls handed to the extraction pipeline, so an
+    # interrupted run can be resumed and failed urls retried
+    id: UUID = Field(default_factory=uuid4, primary_key=True)
+    venue_id: UUID = Field(foreign_key="venue.id", index=True)
+    url: HttpUrl = Field(sa_type=build_sqlmodel_type(HttpUrl), unique=True, index=True)
+
+    state: JobState = Field(index=True)
+    attempts: int = 0
+    error: str | None = None
+    # Failures worth retrying, and not before `next_attempt_at`
+    transient: bool = False
+    next_attempt_at: datetime | None = None
+    updated_at: datetime
+
 
 class ContentBlockSpec(SQLModel, table=True):
     id: UUID = Field(default_factory=uuid4, primary_key=True)
@@ -101,6 +342,10 @@ class ContentBlockSpec(SQLModel, table=True):
         sa_type=build_sqlmodel_list_type(str), default=["a", "img"]
     )
 
+    @property
+    def cleaning_pipeline(self) -> CleaningPipeline:
+        return compile_pipeline(tuple(self.remove_regex), tuple(self.strip_elements))
+
 
 class ContentBlock(BaseModel):
     spec: ContentBlockSpec
@@ -118,47 +363,27 @@ class ContentBlock(BaseModel):
             return self
         if self.is_markdown:
             return self
-        else:
-            markdown_options = {
-                "strip": ["script", "style"] + self.spec.strip_elements,
-                "heading_style": "ATX",
-                "bullets": "-",
+        return self.model_copy(
+            update={
+                "content": self.spec.cleaning_pipeline.markdown(self.content),
+                "is_markdown": True,
             }
-            return self.model_copy(
-                update={
-                    "content": markdownify(self.content, **markdown_options),
-                    "is_markdown": True,
-                }
-            )
+        )
 
     @property
     def clean_markdown(self) -> "ContentBlock":
-        block = self.markdown.model_copy()
-        for regex in self.spec.remove_regex:
-            if block.content is None:
-                break
-            if block.content == "":
-                block = block.update_content(None)
-                break
-            assert block.content is not None
-            block = block.update_content(re.sub(regex, "", block.content))
-        if block.content is None:
-            return block
-
-        # Remove multiple blank lines
-        block = block.update_content(re.sub(r"\n\s*\n\s*\n", "\n\n", block.content))
-
-        # Remove trailing whitespace
-        assert block.content is not None
-        block = block.update_content(
-            "\n".join(line.rstrip() for line in block.content.splitlines())
+        if self.content is None:
+            return self
+        return self.model_copy(
+            update={
+                "content": self.spec.cleaning_pipeline(self.content, self.is_markdown),
+                "is_markdown": True,
+            }
         )
-        assert block.content is not None
-        block = block.update_content(block.content.strip() + "\n")
 
-        if block.content in ["", " ", "\n"]:
-            block = block.update_content(None)
-        return block
+    @classmethod
+    def clean_many(cls, blocks: Iterable["ContentBlock"]) -> list["ContentBlock"]:
+        return [block.clean_markdown for block in blocks]
 
 
 class PaginationType(Enum):
@@ -172,7 +397,7 @@ class VenueSpec(SQLModel, table=True):
     id: UUID = Field(default_factory=uuid4, primary_key=True)
 
     venue: Venue = Relationship(back_populates="specs")
-    venue_id: UUID = Field(foreign_key="venue.id")
+    venue_id: UUID = Field(foreign_key="venue.id", index=True)
     content_block_specs: list[ContentBlockSpec] = Relationship(
         back_populates="venue_spec"
     )
@@ -185,6 +410,17 @@ class VenueSpec(SQLModel, table=True):
     pagination_simple_start_from: int | None = None
     pagination_date_format: str | None = None
 
+    # Per-host politeness limits (defaults come from the scraper's rate limiter)
+    max_concurrency: int | None = None
+    requests_per_second: float | None = None
+    # Download budget for a single page (defaults to the fetcher's)
+    max_page_bytes: int | None = None
+
+    # Per-venue cache TTLs in seconds (defaults come from the cache policies)
+    schedule_cache_ttl: int | None = None
+    content_blocks_cache_ttl: int | None = None
+    extraction_cache_ttl: int | None = None
+
     @model_validator(mode="after")
     def validate_pagination(self) -> Self:
         match self.pagination_type:
@@ -230,6 +466,14 @@ class VenueSpec(SQLModel, table=True):
                 ), "Month pagination limit must be set"
         return self
 
+    def cache_ttl(self, stage: CacheStage) -> timedelta | None:
+        ttl = {
+            CacheStage.SCHEDULE: self.schedule_cache_ttl,
+            CacheStage.CONTENT_BLOCKS: self.content_blocks_cache_ttl,
+            CacheStage.EXTRACTION: self.extraction_cache_ttl,
+        }.get(stage)
+        return timedelta(seconds=ttl) if ttl is not None else None
+
     @property
     def pagination_urls(self) -> list[HttpUrl]:
         match self.pagination_type:
@@ -323,7 +567,10 @@ class EventData(BaseModel):
     def as_event(self, url: HttpUrl, venue_id: UUID):
         return Event(
             title=self.title,
-            schedule=[EventDateTime(datetime=datetime) for datetime in self.schedule],
+            schedule=[
+                EventDateTime(datetime=datetime)
+                for datetime in dict.fromkeys(self.schedule)
+            ],
             author=self.author,
             description=self.description,
             duration=self.duration,
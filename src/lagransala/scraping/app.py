@@ -1,26 +1,57 @@
+import asyncio
 import logging
+from datetime import datetime
+from functools import partial
 from pathlib import Path
-from typing import Awaitable, Callable
+from typing import Awaitable, Callable, Sequence
 from uuid import UUID
 
 import aiohttp
 import groq
-from anthropic import RateLimitError
-from langfuse.decorators import observe
 from pydantic import HttpUrl, ValidationError
-from redis import StrictRedis
 from sqlmodel import Session, select
-from tqdm.asyncio import tqdm_asyncio
+from tqdm import tqdm
 
+from ..cache import Cache, CacheNamespace, CacheStage
 from ..deps import (
     INSTRUCTOR_MODEL,
+    initialize_batch_provider,
+    initialize_cache,
     initialize_instructor_groq,
-    initialize_redis,
+    initialize_llm_concurrency,
     initialize_sqlmodel,
 )
-from ..models import ContentBlock, Event, ExtractionData, Venue, VenueSpec
+from ..models import (
+    ContentBlock,
+    Event,
+    ExtractionData,
+    SingleExtraction,
+    Venue,
+    VenueSpec,
+)
 from ..scraping.scrapers import ContentBlocksScraper, ScheduleScraper
+from ..utils.content_hash import content_hash
+from .batch import DEFAULT_POLL_INTERVAL, BatchExtraction
+from .cpu_pool import DEFAULT_CPU_WORKERS, CpuPool
+from .db_writer import EventWriter
 from .extractors import EventDataExtractor
+from .fetcher import (
+    DEFAULT_MAX_BYTES,
+    HtmlFetcher,
+    HttpStatusError,
+    UnsupportedContentError,
+)
+from .job_ledger import TRANSIENT_ERRORS, JobLedger
+from .parsers import DEFAULT_PARSER, HtmlParser, get_parser
+from .pipeline import (
+    DEFAULT_EXTRACT_WORKERS,
+    DEFAULT_PARSE_WORKERS,
+    DEFAULT_QUEUE_SIZE,
+    Pipeline,
+    Stage,
+)
+from .rate_limit import HostRateLimiter
+from .scheduler import DEFAULT_WORKERS, FairQueue
 
 logger = logging.getLogger(__name__)
 
@@ -40,49 +71,35 @@ async def main1():
         session.commit()
 
 
-@observe
-async def event_url_pipeline(
-    db_session: Session,
-    block_extractor: Callable[[HttpUrl], Awaitable[list[ContentBlock]]],
-    event_data_extractor: Callable[
-        [HttpUrl, list[ContentBlock]], Awaitable[ExtractionData]
-    ],
-    url: HttpUrl,
-    venue_id: UUID,
-) -> list[Event]:
-    try:
-        content_blocks = await block_extractor(url)
-        event_data = await event_data_extractor(url, content_blocks)
-    except aiohttp.ClientConnectorError as e:
+# Failures that only lose the url they happened on
+URL_ERRORS = (
+    *TRANSIENT_ERRORS,
+    HttpStatusError,
+    UnsupportedContentError,
+    groq.BadRequestError,
+    ValidationError,
+)
+
+
+def log_url_error(url: HttpUrl, e: Exception) -> None:
+    if isinstance(e, aiohttp.ClientConnectorError):
         logger.error(f"ConnectionError:\nurl: {str(url)}\nError: {str(e)}")
-        return []
-    except aiohttp.ConnectionTimeoutError as e:
-        logger.error(str(e))
-        return []
-    except groq.BadRequestError as e:
+    elif isinstance(e, TimeoutError):
+        logger.error(f"Timeout while fetching {url}: {str(e)}")
+    elif isinstance(e, (UnsupportedContentError, HttpStatusError)):
+        logger.warning(str(e))
+    elif isinstance(e, groq.BadRequestError):
         logger.error(e.message)
         logger.error(e.body)
-        return []
-    except ValidationError as e:
+    elif isinstance(e, ValidationError):
         msg = f"ValidationError while extracting from {url}:\n"
         for error in e.errors():
             msg += f'- message: {error["msg"]}\n'
             msg += f'  loc:     {error["loc"]}\n'
             msg += f'  input:   {error["input"]}\n'
         logger.error(msg)
-        return []
-    except RateLimitError as e:
-        logger.error(
-            f"RateLimitError while extracting from {url}:\n{e.response.json()}"
-        )
-        return []
     else:
-        events = event_data.as_events(url, venue_id)
-        for event in events:
-            db_session.add(event)
-        db_session.commit()
-        logger.info(f"Committed {len(events)} events from {url}")
-        return events
+        logger.error(f"{type(e).__name__} while processing {url}: {e}")
 
 
 def get_spec_by_id(specs: list[VenueSpec], venue_id: UUID) -> VenueSpec | None:
@@ -92,36 +109,330 @@ def get_spec_by_id(specs: list[VenueSpec], venue_id: UUID) -> VenueSpec | None:
     return None
 
 
-async def extract_events_from_venue(
+class VenueJob:
+    def __init__(
+        self,
+        venue_spec: VenueSpec,
+        content_blocks_scraper: ContentBlocksScraper,
+        event_data_extractor: Callable[
+            [HttpUrl, list[ContentBlock]], Awaitable[ExtractionData]
+        ],
+        extraction_cache: CacheNamespace,
+        urls: set[HttpUrl],
+        position: int,
+        stored_hashes: dict[HttpUrl, str | None] | None = None,
+    ) -> None:
+        self.venue_spec = venue_spec
+        self.slug = venue_spec.venue.slug
+        self.content_blocks_scraper = content_blocks_scraper
+        self.event_data_extractor = event_data_extractor
+        self.extraction_cache = extraction_cache
+        self.urls = urls
+        # Content hashes of the stored events being refreshed
+        self.stored_hashes = stored_hashes or {}
+        self.events = 0
+        self.unchanged = 0
+        self.progress = tqdm(total=len(urls), desc=self.slug, position=position)
+
+
+async def venue_scrapers(
+    http_session: aiohttp.ClientSession,
+    cache: Cache,
+    venue_spec: VenueSpec,
+    rate_limiter: HostRateLimiter,
+    parser: HtmlParser,
+    cpu_pool: CpuPool,
+    revalidate: bool = False,
+) -> tuple[ScheduleScraper, ContentBlocksScraper]:
+    # With `revalidate`, cached pages are always checked with their host
+    rate_limiter.configure_venue(venue_spec)
+    fetcher = HtmlFetcher(
+        http_session,
+        await venue_namespace(cache, venue_spec, CacheStage.HTTP_VALIDATORS),
+        rate_limiter,
+        max_bytes=venue_spec.max_page_bytes or DEFAULT_MAX_BYTES,
+        revalidate=revalidate,
+    )
+    schedule_scraper = ScheduleScraper(
+        fetcher,
+        await venue_namespace(cache, venue_spec, CacheStage.SCHEDULE),
+        venue_spec,
+        parser,
+    )
+    content_blocks_scraper = ContentBlocksScraper(
+        fetcher,
+        await venue_namespace(cache, venue_spec, CacheStage.CONTENT_BLOCKS),
+        venue_spec,
+        parser,
+        cpu_pool,
+    )
+    return schedule_scraper, content_blocks_scraper
+
+
+async def venue_namespace(
+    cache: Cache, venue_spec: VenueSpec, stage: CacheStage
+) -> CacheNamespace:
+    return await cache.namespace(
+        stage, venue_spec.venue.slug, venue_spec.cache_ttl(stage)
+    )
+
+
+async def prepare_venue(
     http_session: aiohttp.ClientSession,
     db_session: Session,
-    redis: StrictRedis,
-    event_data_extractor: Callable[
-        [HttpUrl, list[ContentBlock]], Awaitable[ExtractionData]
-    ],
+    cache: Cache,
+    event_data_extractor: EventDataExtractor,
     venue_spec: VenueSpec,
-    event_urls: set[HttpUrl],
+    rate_limiter: HostRateLimiter,
+    parser: HtmlParser,
+    cpu_pool: CpuPool,
+    ledger: JobLedger,
+    position: int,
+    urls: set[HttpUrl] | None = None,
+    refresh: bool = False,
+) -> VenueJob:
+    # Without `urls`, every new url on the venue's listing pages and those an
+    # interrupted run left behind. With `refresh`, the stored upcoming events
+    # instead, they're only extracted again if their page changed
+    schedule_scraper, content_blocks_scraper = await venue_scrapers(
+        http_session, cache, venue_spec, rate_limiter, parser, cpu_pool, refresh
+    )
+    extraction_cache = await venue_namespace(cache, venue_spec, CacheStage.EXTRACTION)
+    venue_event_data_extractor = partial(event_data_extractor, cache=extraction_cache)
+    stored_hashes: dict[HttpUrl, str | None] = {}
+    if refresh:
+        stored_hashes = Event.upcoming_hashes(
+            db_session, venue_spec.venue_id, datetime.now()
+        )
+        if urls is not None:
+            stored_hashes = {url: stored_hashes.get(url) for url in urls}
+        new_urls = set(stored_hashes)
+        logger.info(f"Refreshing {len(new_urls)} urls for {venue_spec.venue.slug}")
+    else:
+        if urls is None:
+            urls = await schedule_scraper() | ledger.unfinished(venue_spec.venue_id)
+        new_urls = urls - Event.known_urls(db_session, urls)
+        logger.info(f"Found {len(new_urls)} new urls for {venue_spec.venue.slug}")
+    queued = await ledger.enqueue(venue_spec.venue_id, new_urls)
+    if skipped := len(new_urls) - len(queued):
+        logger.info(f"Skipping {skipped} failed urls, see `lagransala retry`")
+    new_urls = queued
+    cached_urls = await content_blocks_scraper.prefetch(new_urls)
+    logger.info(f"{len(cached_urls)}/{len(new_urls)} new urls already scraped")
+    return VenueJob(
+        venue_spec,
+        content_blocks_scraper,
+        venue_event_data_extractor,
+        extraction_cache,
+        new_urls,
+        position,
+        stored_hashes,
+    )
+
+
+class UrlWork:
+    # One event url on its way through the extraction pipeline
+    def __init__(self, job: VenueJob, url: HttpUrl) -> None:
+        self.job = job
+        self.url = url
+        self.html: str | None = None
+        self.blocks: list[ContentBlock] | None = None
+        self.extraction: ExtractionData | None = None
+        self.content_hash: str | None = None
+
+
+async def extract_events_from_venues(
+    http_session: aiohttp.ClientSession,
+    db_session: Session,
+    event_writer: EventWriter,
+    cache: Cache,
+    event_data_extractor: EventDataExtractor,
+    venue_specs: Sequence[VenueSpec],
+    rate_limiter: HostRateLimiter,
+    parser: HtmlParser,
+    cpu_pool: CpuPool,
+    ledger: JobLedger,
+    workers: int = DEFAULT_WORKERS,
+    parse_workers: int = DEFAULT_PARSE_WORKERS,
+    extract_workers: int = DEFAULT_EXTRACT_WORKERS,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+    venue_urls: dict[UUID, set[HttpUrl]] | None = None,
+    refresh: bool = False,
+    batch: BatchExtraction[UrlWork] | None = None,
 ):
-    schedule_scraper = ScheduleScraper(http_session, redis, venue_spec)
-    content_blocks_scraper = ContentBlocksScraper(http_session, redis, venue_spec)
-    urls = await schedule_scraper()
-    new_urls = urls - event_urls
-    logger.info(f"Found {len(new_urls)} new urls for {venue_spec.venue.slug}")
-    await tqdm_asyncio.gather(
-        *[
-            event_url_pipeline(
+    # `venue_urls` gives the urls to extract per venue instead of listing them,
+    # `refresh` extracts stored events again when their pages changed, with
+    # `batch` pages missing from the cache are extracted in one batch job
+    # once every page went through the pipeline.
+    # Every venue feeds the same fetch stage, round-robin, so a run takes as
+    # long as the slowest host instead of the sum of all venues
+    queue: FairQueue[VenueJob, HttpUrl] = FairQueue()
+    jobs: list[VenueJob] = []
+    fair_share = max(1, workers // max(1, len(venue_specs)))
+    batched: set[UrlWork] = set()
+
+    async def produce(venue_spec: VenueSpec, position: int) -> None:
+        try:
+            job = await prepare_venue(
+                http_session,
                 db_session,
-                content_blocks_scraper,
+                cache,
                 event_data_extractor,
-                url,
-                venue_spec.venue_id,
+                venue_spec,
+                rate_limiter,
+                parser,
+                cpu_pool,
+                ledger,
+                position,
+                venue_urls[venue_spec.venue_id] if venue_urls is not None else None,
+                refresh,
             )
-            for url in new_urls
-        ]
+        except Exception as e:
+            logger.error(f"Failed to list event urls of {venue_spec.venue.slug}: {e}")
+            return
+        jobs.append(job)
+        host_limit = rate_limiter.for_url(venue_spec.pagination_url).limits
+        await queue.put_many(job, job.urls, max(host_limit.max_concurrency, fair_share))
+
+    async def produce_all() -> None:
+        await asyncio.gather(
+            *(produce(venue_spec, i) for i, venue_spec in enumerate(venue_specs))
+        )
+        await queue.close()
+
+    async def fetch(work: UrlWork) -> bool:
+        try:
+            fetched = await work.job.content_blocks_scraper.fetch(work.url)
+        except URL_ERRORS as e:
+            log_url_error(work.url, e)
+            ledger.failed(work.url, e)
+            return False
+        finally:
+            # The venue's fetch slot is free, its next url can be scheduled
+            await queue.done(work.job)
+        ledger.fetched(work.url)
+        if isinstance(fetched, list):
+            work.blocks = fetched
+        else:
+            work.html = fetched
+        return True
+
+    async def parse(work: UrlWork) -> bool:
+        if work.blocks is None:
+            scraper = work.job.content_blocks_scraper
+            work.blocks = await scraper.parse(work.html or "")
+            work.html = None
+            await scraper.store(work.url, work.blocks)
+        return True
+
+    async def extract(work: UrlWork) -> bool:
+        assert work.blocks is not None
+        work.content_hash = content_hash(work.blocks)
+        if work.job.stored_hashes.get(work.url, "") == work.content_hash:
+            # The stored event was extracted from this very content
+            ledger.extracted(work.url)
+            work.job.unchanged += 1
+            return False
+        try:
+            if batch is None:
+                work.extraction = await work.job.event_data_extractor(
+                    work.url, work.blocks
+                )
+            else:
+                work.extraction = await event_data_extractor.cached(
+                    work.url, work.blocks, work.job.extraction_cache
+                )
+                if work.extraction is None:
+                    batch.add(work, work.url, work.blocks, work.job.extraction_cache)
+                    batched.add(work)
+                    return False
+        except URL_ERRORS as e:
+            log_url_error(work.url, e)
+            ledger.failed(work.url, e)
+            return False
+        return True
+
+    async def write(work: UrlWork) -> bool:
+        assert work.extraction is not None
+        events = work.extraction.as_events(work.url, work.job.venue_spec.venue_id)
+        for event in events:
+            event.content_hash = work.content_hash
+        if events:
+            # The ledger hears from the writer once they're committed
+            await event_writer.write(events)
+        else:
+            ledger.extracted(work.url)
+        work.job.events += len(events)
+        logger.info(f"Queued {len(events)} events from {work.url}")
+        return True
+
+    async def failed(work: UrlWork, e: Exception) -> None:
+        # Errors the stages didn't expect, permanent unless known transient so
+        # the url isn't resumed on every run
+        ledger.failed(work.url, e)
+
+    async def done(work: UrlWork) -> None:
+        if work in batched:
+            # Counted once the batch job is done
+            return
+        work.job.progress.update()
+
+    async def batch_done(work: UrlWork, result: SingleExtraction | Exception) -> None:
+        if isinstance(result, Exception):
+            log_url_error(work.url, result)
+            ledger.failed(work.url, result)
+        else:
+            work.extraction = result
+            try:
+                await write(work)
+            except Exception as e:
+                logger.exception(f"Failed to write events from {work.url}")
+                ledger.failed(work.url, e)
+        work.job.progress.update()
+
+    pipeline: Pipeline[UrlWork] = Pipeline(
+        [
+            Stage("fetch", fetch, workers, queue_size),
+            Stage("parse", parse, parse_workers, queue_size),
+            Stage("extract", extract, extract_workers, queue_size),
+            Stage("write", write, 1, queue_size),
+        ],
+        on_done=done,
+        on_failed=failed,
     )
 
+    async def feed() -> None:
+        # Blocks while the fetch stage is full, backpressure stops here
+        while (taken := await queue.get()) is not None:
+            await pipeline.put(UrlWork(*taken))
 
-async def main(venue_slugs: list[str] | None = None):
+    async with pipeline:
+        await asyncio.gather(produce_all(), feed())
+    if batch is not None and batch.pending:
+        logger.info(f"Extracting {len(batch.pending)} pages in batch")
+        await batch.run(batch_done)
+    for job in jobs:
+        job.progress.close()
+        logger.info(
+            f"{job.slug}: {job.events} events from {len(job.urls)} urls"
+            + (f", {job.unchanged} unchanged" if job.stored_hashes else "")
+        )
+
+
+async def main(
+    venue_slugs: list[str] | None = None,
+    parser_name: str = DEFAULT_PARSER,
+    workers: int = DEFAULT_WORKERS,
+    parse_workers: int = DEFAULT_PARSE_WORKERS,
+    extract_workers: int = DEFAULT_EXTRACT_WORKERS,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+    cpu_workers: int = DEFAULT_CPU_WORKERS,
+    retry: bool = False,
+    refresh: bool = False,
+    batch: bool = False,
+    poll_interval: float = DEFAULT_POLL_INTERVAL,
+):
+    # With `retry`, only the transient failures whose backoff is over
     logging.basicConfig(
         level=logging.INFO,
         format="%(asctime)s %(levelname)s: %(message)s",
@@ -130,11 +441,21 @@ async def main(venue_slugs: list[str] | None = None):
 
     engine = initialize_sqlmodel()
     instructor_client = initialize_instructor_groq()
-    redis = initialize_redis()
+    cache = initialize_cache()
 
     event_data_extractor = EventDataExtractor(
-        instructor_client, redis, model=INSTRUCTOR_MODEL
+        instructor_client,
+        model=INSTRUCTOR_MODEL,
+        concurrency=initialize_llm_concurrency(),
     )
+    rate_limiter = HostRateLimiter()
+    parser = get_parser(parser_name)
+    cpu_pool = CpuPool(cpu_workers)
+    batch_extraction: BatchExtraction[UrlWork] | None = None
+    if batch:
+        batch_extraction = BatchExtraction(
+            initialize_batch_provider(), event_data_extractor, poll_interval
+        )
 
     with Session(engine) as db_session:
         Venue.seed_from_yaml(db_session, Path("./seeders/venues.yaml"))
@@ -147,7 +468,6 @@ async def main(venue_slugs: list[str] | None = None):
                 for venue_spec in venue_specs
                 if venue_spec.venue.slug in venue_slugs
             ]
-        event_urls = Event.get_urls(db_session)  # TODO: this could get really big
 
         headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)",
@@ -157,13 +477,55 @@ async def main(venue_slugs: list[str] | None = None):
             "Connection": "keep-alive",
         }
 
-        async with aiohttp.ClientSession(headers=headers) as http_session:
-            for venue_spec in venue_specs:
-                await extract_events_from_venue(
-                    http_session,
-                    db_session,
-                    redis,
-                    event_data_extractor,
-                    venue_spec,
-                    event_urls,
-                )
+        ledger = JobLedger(engine)
+        venue_urls = None
+        if retry:
+            venue_ids = [venue_spec.venue_id for venue_spec in venue_specs]
+            venue_urls = ledger.requeue(venue_ids)
+            failures = ledger.counts(venue_ids)
+            logger.info(
+                f"Retrying {sum(map(len, venue_urls.values()))} failed urls, "
+                f"{failures.get('backing off', 0)} still backing off, "
+                f"{failures.get('permanent', 0)} failed permanently"
+            )
+            venue_specs = [
+                venue_spec
+                for venue_spec in venue_specs
+                if venue_spec.venue_id in venue_urls
+            ]
+
+        # The writer reports to the ledger, the ledger closes after it
+        async with (
+            aiohttp.ClientSession(headers=headers) as http_session,
+            ledger,
+            EventWriter(
+                engine,
+                on_commit=cache.bump_data_version,
+                on_written=ledger.committed,
+                on_failed=ledger.not_committed,
+            ) as event_writer,
+        ):
+            await extract_events_from_venues(
+                http_session,
+                db_session,
+                event_writer,
+                cache,
+                event_data_extractor,
+                venue_specs,
+                rate_limiter,
+                parser,
+                cpu_pool,
+                ledger,
+                workers,
+                parse_workers,
+                extract_workers,
+                queue_size,
+                venue_urls,
+                refresh,
+                batch_extraction,
+            )
+        rate_limiter.log_stats()
+    cpu_pool.close()
+    if batch_extraction is not None:
+        await batch_extraction.provider.close()
+    await cache.close()
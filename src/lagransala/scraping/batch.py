@@ -0,0 +1,264 @@
+import asyncio
+import json
+import logging
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Generic, TypeVar
+
+import aiohttp
+from pydantic import BaseModel, HttpUrl, ValidationError
+
+from ..cache import CacheNamespace
+from ..models import ContentBlock, SingleExtraction
+
+if TYPE_CHECKING:
+    from .extractors import EventDataExtractor
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Groq takes up to 50k requests per batch
+DEFAULT_MAX_REQUESTS = 10_000
+
+# Batches take minutes to hours, no point in asking more often
+DEFAULT_POLL_INTERVAL = 30
+
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+class Batch(BaseModel):
+    id: str
+    status: str
+    output_file_id: str | None = None
+    error_file_id: str | None = None
+
+
+class BatchResult(BaseModel):
+    custom_id: str
+    completion: dict[str, Any] | None = None
+    error: str | None = None
+
+
+class BatchProvider(ABC):
+    """A batch API taking chat completion requests as JSONL."""
+
+    endpoint = "/v1/chat/completions"
+
+    @abstractmethod
+    async def submit(self, requests: list[dict[str, Any]]) -> Batch:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def get(self, batch_id: str) -> Batch:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def results(self, batch: Batch) -> list[BatchResult]:
+        raise NotImplementedError()
+
+    async def wait(self, batch: Batch, poll_interval: float) -> Batch:
+        while batch.status not in TERMINAL_STATUSES:
+            await asyncio.sleep(poll_interval)
+            batch = await self.get(batch.id)
+            logger.debug(f"Batch {batch.id} is {batch.status}")
+        return batch
+
+    async def close(self) -> None:
+        pass
+
+
+class OpenAIBatchProvider(BatchProvider):
+    """OpenAI's batch API, which Groq and most compatible servers implement.
+
+    `base_url` is the API root, e.g. `https://api.groq.com/openai/v1`.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        endpoint: str = "/v1/chat/completions",
+        completion_window: str = "24h",
+    ) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.endpoint = endpoint
+        self.completion_window = completion_window
+        self._session: aiohttp.ClientSession | None = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                timeout=aiohttp.ClientTimeout(total=300, connect=10),
+                raise_for_status=True,
+            )
+        return self._session
+
+    async def submit(self, requests: list[dict[str, Any]]) -> Batch:
+        body = "".join(json.dumps(request) + "\n" for request in requests)
+        form = aiohttp.FormData()
+        form.add_field("purpose", "batch")
+        form.add_field(
+            "file",
+            body.encode(),
+            filename="batch.jsonl",
+            content_type="application/jsonl",
+        )
+        async with self.session.post(f"{self.base_url}/files", data=form) as response:
+            input_file_id = (await response.json())["id"]
+        async with self.session.post(
+            f"{self.base_url}/batches",
+            json={
+                "input_file_id": input_file_id,
+                "endpoint": self.endpoint,
+                "completion_window": self.completion_window,
+            },
+        ) as response:
+            return Batch.model_validate(await response.json())
+
+    async def get(self, batch_id: str) -> Batch:
+        async with self.session.get(f"{self.base_url}/batches/{batch_id}") as response:
+            return Batch.model_validate(await response.json())
+
+    async def _lines(self, file_id: str) -> list[dict[str, Any]]:
+        async with self.session.get(
+            f"{self.base_url}/files/{file_id}/content"
+        ) as response:
+            text = await response.text()
+        return [json.loads(line) for line in text.splitlines() if line]
+
+    async def results(self, batch: Batch) -> list[BatchResult]:
+        results: list[BatchResult] = []
+        # Expired batches may still have completed part of their requests
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id is None:
+                continue
+            for line in await self._lines(file_id):
+                response = line.get("response") or {}
+                if line.get("error") or response.get("status_code") != 200:
+                    error = line.get("error") or response.get("body")
+                    results.append(
+                        BatchResult(custom_id=line["custom_id"], error=str(error))
+                    )
+                else:
+                    results.append(
+                        BatchResult(
+                            custom_id=line["custom_id"], completion=response["body"]
+                        )
+                    )
+        return results
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class BatchFailedError(Exception):
+    pass
+
+
+# The request never ran, the job ledger retries it later
+class BatchIncompleteError(Exception):
+    pass
+
+
+class BatchExtraction(Generic[T]):
+    """Collects pages the extractor has no cached answer for and extracts
+    them all through a batch API instead of one request per page.
+
+    Items are the caller's own, `done` gets each one back with its
+    extraction, or with the exception that made it fail.
+    """
+
+    def __init__(
+        self,
+        provider: BatchProvider,
+        event_data_extractor: "EventDataExtractor",
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        max_requests: int = DEFAULT_MAX_REQUESTS,
+    ) -> None:
+        self.provider = provider
+        self.event_data_extractor = event_data_extractor
+        self.poll_interval = poll_interval
+        self.max_requests = max_requests
+        self.pending: list[tuple[T, HttpUrl, list[ContentBlock], CacheNamespace]] = []
+
+    def add(
+        self,
+        item: T,
+        url: HttpUrl,
+        content_blocks: list[ContentBlock],
+        cache: CacheNamespace,
+    ) -> None:
+        self.pending.append((item, url, content_blocks, cache))
+
+    async def run(
+        self,
+        done: Callable[[T, SingleExtraction | Exception], Awaitable[None]],
+    ) -> None:
+        pending, self.pending = self.pending, []
+        chunks = [
+            pending[i : i + self.max_requests]
+            for i in range(0, len(pending), self.max_requests)
+        ]
+        await asyncio.gather(*(self._run_chunk(chunk, done) for chunk in chunks))
+
+    async def _run_chunk(
+        self,
+        chunk: list[tuple[T, HttpUrl, list[ContentBlock], CacheNamespace]],
+        done: Callable[[T, SingleExtraction | Exception], Awaitable[None]],
+    ) -> None:
+        requests = [
+            {
+                "custom_id": str(i),
+                "method": "POST",
+                "url": self.provider.endpoint,
+                "body": self.event_data_extractor.batch_body(content_blocks),
+            }
+            for i, (_, _, content_blocks, _) in enumerate(chunk)
+        ]
+        try:
+            batch = await self.provider.submit(requests)
+            logger.info(f"Submitted batch {batch.id} with {len(requests)} requests")
+            batch = await self.provider.wait(batch, self.poll_interval)
+            logger.info(f"Batch {batch.id} finished as {batch.status}")
+            results = {
+                result.custom_id: result
+                for result in await self.provider.results(batch)
+            }
+        except (aiohttp.ClientError, TimeoutError) as e:
+            logger.error(f"Batch of {len(chunk)} requests failed: {e}")
+            for item, *_ in chunk:
+                await done(item, BatchIncompleteError(f"Batch API error: {e}"))
+            return
+        except (KeyError, ValueError) as e:
+            # An answer the provider client doesn't understand, e.g. a file or
+            # batch missing its id. Only this chunk is lost
+            logger.error(f"Batch of {len(chunk)} requests got a bad response: {e}")
+            for item, *_ in chunk:
+                await done(item, BatchFailedError(f"Bad batch API response: {e!r}"))
+            return
+        for i, (item, url, content_blocks, cache) in enumerate(chunk):
+            result = results.get(str(i))
+            if result is None:
+                await done(
+                    item, BatchIncompleteError(f"Batch {batch.id} {batch.status}")
+                )
+                continue
+            if result.completion is None:
+                await done(item, BatchFailedError(result.error))
+                continue
+            try:
+                extraction_data = self.event_data_extractor.parse_completion(
+                    result.completion
+                )
+            except (ValidationError, KeyError, IndexError, TypeError) as e:
+                await done(item, e)
+                continue
+            await self.event_data_extractor.store(
+                url, content_blocks, cache, extraction_data
+            )
+            await done(item, extraction_data)
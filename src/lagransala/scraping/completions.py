@@ -0,0 +1,50 @@
+from datetime import date
+from typing import Any
+
+from instructor import openai_schema
+from jinja2 import Template
+
+from ..models import ContentBlock, SingleExtraction
+
+USER_PROMPT_TEMPLATE = """
+                            {% for block in blocks %}
+                            <block>
+                                <relevant>{{ block.relevant }}</relevant>
+                                {% if block.irrelevant %}
+                                <irrelevant>{{ block.irrelevant }}</irrelevant>
+                                {% endif %}
+                                <content>{{ block.content }}</content>
+                            </block>
+                            {% endfor %}
+                            """
+
+
+def completion_body(
+    model: str,
+    max_tokens: int,
+    system_prompt: str,
+    content_blocks: list[ContentBlock],
+) -> dict[str, Any]:
+    # The chat completion request `EventDataExtractor` makes through
+    # instructor, spelled out for batch APIs that take raw request bodies
+    context = {"blocks": content_blocks, "current_year": date.today().year}
+    schema = openai_schema(SingleExtraction).openai_schema
+    return {
+        "model": model,
+        "max_tokens": max_tokens,
+        "messages": [
+            {"role": "system", "content": Template(system_prompt).render(context)},
+            {
+                "role": "user",
+                "content": Template(USER_PROMPT_TEMPLATE).render(context),
+            },
+        ],
+        "tools": [{"type": "function", "function": schema}],
+        "tool_choice": {"type": "function", "function": {"name": schema["name"]}},
+    }
+
+
+def parse_completion(completion: dict[str, Any]) -> SingleExtraction:
+    message = completion["choices"][0]["message"]
+    arguments = message["tool_calls"][0]["function"]["arguments"]
+    return SingleExtraction.model_validate_json(arguments)
@@ -0,0 +1,78 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from ..cleaning import compile_pipeline
+from ..models import ContentBlock, ContentBlockSpec
+from .parsers import HtmlParser
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CPU_WORKERS = os.cpu_count() or 1
+
+# What a worker needs from a ContentBlockSpec: selector, remove_regex and
+# strip_elements. Specs are table models bound to a session, they stay here
+BlockRecipe = tuple[str, tuple[str, ...], tuple[str, ...]]
+
+
+def _recipe(spec: ContentBlockSpec) -> BlockRecipe:
+    return spec.selector, tuple(spec.remove_regex), tuple(spec.strip_elements)
+
+
+def clean_blocks(
+    parser: HtmlParser, html: str, recipes: list[BlockRecipe]
+) -> list[tuple[str | None, bool]]:
+    """Cleaned markdown of each block and whether it went through cleaning.
+
+    Same result as `ContentBlock.clean_many` on the parsed blocks, so it can
+    run inline or in a worker process.
+    """
+    contents = parser.blocks(html, [selector for selector, _, _ in recipes])
+    result: list[tuple[str | None, bool]] = []
+    for (_, remove_regex, strip_elements), content in zip(recipes, contents):
+        if content is None:
+            result.append((None, False))
+        else:
+            pipeline = compile_pipeline(remove_regex, strip_elements)
+            result.append((pipeline(content), True))
+    return result
+
+
+class CpuPool:
+    """Parses and cleans event pages in worker processes.
+
+    BeautifulSoup/lxml parsing and markdownify hold the GIL, inline they
+    stall every fetch and LLM call in flight. With 0 workers pages are still
+    parsed inline on the event loop.
+    """
+
+    def __init__(self, workers: int = DEFAULT_CPU_WORKERS) -> None:
+        self.workers = workers
+        self.executor: ProcessPoolExecutor | None = None
+        if workers > 0:
+            # By now the process runs threads, forking it could deadlock. The
+            # fork server starts clean and imports this module once for all
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload([__name__])
+            self.executor = ProcessPoolExecutor(workers, mp_context=context)
+
+    async def content_blocks(
+        self, parser: HtmlParser, specs: list[ContentBlockSpec], html: str
+    ) -> list[ContentBlock]:
+        recipes = [_recipe(spec) for spec in specs]
+        if self.executor is None:
+            cleaned = clean_blocks(parser, html, recipes)
+        else:
+            cleaned = await asyncio.get_running_loop().run_in_executor(
+                self.executor, clean_blocks, parser, html, recipes
+            )
+        return [
+            ContentBlock(spec=spec, content=content, is_markdown=is_markdown)
+            for spec, (content, is_markdown) in zip(specs, cleaned)
+        ]
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
@@ -0,0 +1,467 @@
+import asyncio
+import hashlib
+import logging
+import math
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Sequence
+from uuid import UUID
+
+import aiohttp
+from pydantic import BaseModel, HttpUrl
+from sqlalchemy import Engine, exists
+from sqlmodel import Session, col, select
+
+from ..cache import Cache
+from ..deps import (
+    INSTRUCTOR_MODEL,
+    initialize_cache,
+    initialize_instructor_groq,
+    initialize_llm_concurrency,
+    initialize_sqlmodel,
+)
+from ..models import CrawlState, Event, EventDateTime, PageKind, Venue, VenueSpec
+from ..utils.content_hash import content_hash
+from .app import URL_ERRORS, extract_events_from_venues, log_url_error, venue_scrapers
+from .cpu_pool import DEFAULT_CPU_WORKERS, CpuPool
+from .db_writer import EventWriter
+from .extractors import EventDataExtractor
+from .job_ledger import JobLedger
+from .parsers import DEFAULT_PARSER, HtmlParser, get_parser
+from .rate_limit import HostRateLimiter
+from .scheduler import DEFAULT_BUDGET, DEFAULT_INTERVAL_MINUTES
+from .scrapers import ContentBlocksScraper, ScheduleScraper
+
+logger = logging.getLogger(__name__)
+
+# Listing pages are where new events show up
+WEIGHTS = {PageKind.LISTING: 2.0, PageKind.EVENT: 1.0}
+
+
+def utcnow() -> datetime:
+    # SQLite hands back naive datetimes, crawl times are naive UTC throughout
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def urls_hash(urls: set[HttpUrl]) -> str:
+    return hashlib.sha256("\n".join(sorted(map(str, urls))).encode()).hexdigest()
+
+
+class RecrawlPolicy:
+    def __init__(
+        self,
+        min_interval: timedelta = timedelta(hours=1),
+        max_interval: timedelta = timedelta(days=7),
+        initial_interval: timedelta = timedelta(hours=12),
+    ) -> None:
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.initial_interval = initial_interval
+
+    def change_rate(self, state: CrawlState) -> float:
+        """Estimated changes per second of the page."""
+        if state.checks == 0 or state.observed_seconds <= 0:
+            return 1 / self.initial_interval.total_seconds()
+        # Cho & Garcia-Molina's estimator, unlike changes / time it accounts
+        # for several changes happening between two fetches
+        n, changes = state.checks, state.changes
+        return -math.log((n - changes + 0.5) / (n + 0.5)) * n / state.observed_seconds
+
+    def interval(
+        self, state: CrawlState, previous: timedelta | None = None
+    ) -> timedelta:
+        rate = self.change_rate(state)
+        interval = self.max_interval if rate <= 0 else timedelta(seconds=1 / rate)
+        if previous is not None:
+            # A few unchanged fetches estimate a rate of zero, back off gradually
+            interval = min(interval, 2 * max(previous, self.min_interval))
+        return max(self.min_interval, min(self.max_interval, interval))
+
+    def value(self, state: CrawlState, now: datetime) -> float:
+        # Weighted probability that the page changed since it was last fetched
+        weight = WEIGHTS[state.kind]
+        if state.last_fetched_at is None:
+            return weight
+        elapsed = (now - state.last_fetched_at).total_seconds()
+        return weight * (1 - math.exp(-self.change_rate(state) * elapsed))
+
+    def record(self, state: CrawlState, now: datetime, content_hash: str) -> bool:
+        changed = state.content_hash is not None and content_hash != state.content_hash
+        previous = None
+        if state.content_hash is not None and state.last_fetched_at is not None:
+            previous = now - state.last_fetched_at
+            state.checks += 1
+            state.changes += changed
+            state.observed_seconds += previous.total_seconds()
+        if changed:
+            state.last_changed_at = now
+        state.content_hash = content_hash
+        state.last_fetched_at = now
+        state.failures = 0
+        state.next_fetch_at = now + self.interval(state, previous)
+        return changed
+
+    def record_failure(self, state: CrawlState, now: datetime) -> None:
+        # Nothing learnt, try again later every time it keeps failing
+        state.failures += 1
+        backoff = self.min_interval * 2 ** min(state.failures - 1, 20)
+        state.next_fetch_at = now + min(backoff, self.max_interval)
+
+
+class CrawlStats(BaseModel):
+    listings: int = 0
+    listings_changed: int = 0
+    new_urls: int = 0
+    events: int = 0
+    events_changed: int = 0
+    failed: int = 0
+    deferred: int = 0
+
+    @property
+    def fetches(self) -> int:
+        return self.listings + self.new_urls + self.events
+
+
+class Crawler:
+    """Recrawls listing and event pages when they're likely to have changed.
+
+    Every page has a `CrawlState` with its own recrawl interval, learnt from
+    how often it was seen changing. A run fetches the due pages, listings
+    first, then urls that still have no event, then known events by the
+    probability they changed, until `budget` fetches were made. Urls that
+    already failed to produce an event come last and back off like failed
+    fetches. Events whose page changed are extracted again and replaced.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        http_session: aiohttp.ClientSession,
+        cache: Cache,
+        event_data_extractor: EventDataExtractor,
+        rate_limiter: HostRateLimiter,
+        parser: HtmlParser,
+        cpu_pool: CpuPool,
+        policy: RecrawlPolicy | None = None,
+        budget: int = DEFAULT_BUDGET,
+    ) -> None:
+        self.engine = engine
+        self.http_session = http_session
+        self.cache = cache
+        self.event_data_extractor = event_data_extractor
+        self.rate_limiter = rate_limiter
+        self.parser = parser
+        self.cpu_pool = cpu_pool
+        self.policy = policy or RecrawlPolicy()
+        self.budget = budget
+        self.venue_scrapers: dict[
+            UUID, tuple[ScheduleScraper, ContentBlocksScraper]
+        ] = {}
+
+    async def scrapers(
+        self, venue_spec: VenueSpec
+    ) -> tuple[ScheduleScraper, ContentBlocksScraper]:
+        if venue_spec.venue_id not in self.venue_scrapers:
+            self.venue_scrapers[venue_spec.venue_id] = await venue_scrapers(
+                self.http_session,
+                self.cache,
+                venue_spec,
+                self.rate_limiter,
+                self.parser,
+                self.cpu_pool,
+                revalidate=True,
+            )
+        return self.venue_scrapers[venue_spec.venue_id]
+
+    def register(
+        self,
+        session: Session,
+        venue_id: UUID,
+        kind: PageKind,
+        urls: set[HttpUrl],
+        now: datetime,
+    ) -> int:
+        pending = urls - CrawlState.known_urls(session, urls)
+        for url in pending:
+            session.add(
+                CrawlState(venue_id=venue_id, kind=kind, url=url, next_fetch_at=now)
+            )
+        return len(pending)
+
+    def due(
+        self, session: Session, venue_spec: VenueSpec, kind: PageKind, now: datetime
+    ) -> Sequence[CrawlState]:
+        query = select(CrawlState).where(
+            CrawlState.venue_id == venue_spec.venue_id,
+            CrawlState.kind == kind,
+            CrawlState.next_fetch_at <= now,
+        )
+        if kind == PageKind.LISTING:
+            # Dated pagination leaves old listing pages behind
+            query = query.where(
+                col(CrawlState.url).in_(  # type: ignore[arg-type]
+                    venue_spec.pagination_urls
+                )
+            )
+        else:
+            # Only events still to come are worth refreshing
+            upcoming = (
+                select(Event.id)
+                .join(EventDateTime)
+                .where(Event.url == CrawlState.url, EventDateTime.datetime >= now)
+            )
+            stored = select(Event.id).where(Event.url == CrawlState.url)
+            query = query.where(exists(upcoming) | ~exists(stored))
+        return session.exec(query).all()
+
+    async def run_once(
+        self, session: Session, venue_specs: Sequence[VenueSpec]
+    ) -> CrawlStats:
+        stats = CrawlStats()
+        now = utcnow()
+        # Dated pagination and cache namespaces may have moved since last run
+        self.venue_scrapers = {}
+        specs = {venue_spec.venue_id: venue_spec for venue_spec in venue_specs}
+        for venue_spec in venue_specs:
+            self.register(
+                session,
+                venue_spec.venue_id,
+                PageKind.LISTING,
+                set(venue_spec.pagination_urls),
+                now,
+            )
+            self.register(
+                session,
+                venue_spec.venue_id,
+                PageKind.EVENT,
+                Event.get_urls(session, venue_spec.venue_id),
+                now,
+            )
+        session.commit()
+
+        listings = sorted(
+            (
+                state
+                for venue_spec in venue_specs
+                for state in self.due(session, venue_spec, PageKind.LISTING, now)
+            ),
+            key=lambda state: self.policy.value(state, now),
+            reverse=True,
+        )
+        stats.deferred += max(0, len(listings) - self.budget)
+        listings = listings[: self.budget]
+        discovered = await asyncio.gather(
+            *(
+                self.fetch_listing(specs[state.venue_id], state, stats)
+                for state in listings
+            )
+        )
+        for state, urls in zip(listings, discovered):
+            self.register(session, state.venue_id, PageKind.EVENT, urls, now)
+        session.commit()
+
+        budget = self.budget - stats.listings
+        pages = [
+            state
+            for venue_spec in venue_specs
+            for state in self.due(session, venue_spec, PageKind.EVENT, now)
+        ]
+        stored = Event.known_urls(session, (state.url for state in pages))
+        new = [state for state in pages if state.url not in stored]
+        known = sorted(
+            (state for state in pages if state.url in stored),
+            key=lambda state: self.policy.value(state, now),
+            reverse=True,
+        )
+        # A url that never produced an event shouldn't starve known events
+        retried = [state for state in new if state.failures]
+        new = [state for state in new if not state.failures]
+        stats.deferred += max(0, len(new) + len(known) + len(retried) - budget)
+        new = new[:budget]
+        known = known[: budget - len(new)]
+        new += retried[: budget - len(new) - len(known)]
+        if new:
+            await self.extract_new(session, specs, new, stats)
+        changed = await asyncio.gather(
+            *(self.fetch_event(specs[state.venue_id], state, stats) for state in known)
+        )
+        if refreshed := [state for state, c in zip(known, changed) if c]:
+            await self.extract(session, specs, refreshed, refresh=True)
+        session.commit()
+        logger.info(
+            f"Crawled {stats.fetches} pages: {stats.listings} listings "
+            f"({stats.listings_changed} changed), {stats.new_urls} new urls, "
+            f"{stats.events} events ({stats.events_changed} changed), "
+            f"{stats.failed} failed, {stats.deferred} due pages left for later"
+        )
+        return stats
+
+    async def fetch_listing(
+        self, venue_spec: VenueSpec, state: CrawlState, stats: CrawlStats
+    ) -> set[HttpUrl]:
+        try:
+            schedule_scraper, _ = await self.scrapers(venue_spec)
+            urls = await schedule_scraper.page_event_urls(state.url)
+        except Exception as e:
+            # Any error only loses this page, not the whole run
+            if isinstance(e, URL_ERRORS):
+                log_url_error(state.url, e)
+            else:
+                logger.exception(f"Failed to crawl listing {state.url}")
+            self.policy.record_failure(state, utcnow())
+            stats.failed += 1
+            return set()
+        stats.listings += 1
+        if self.policy.record(state, utcnow(), urls_hash(urls)):
+            stats.listings_changed += 1
+        return urls
+
+    async def fetch_event(
+        self, venue_spec: VenueSpec, state: CrawlState, stats: CrawlStats
+    ) -> bool:
+        try:
+            _, content_blocks_scraper = await self.scrapers(venue_spec)
+            blocks = await content_blocks_scraper(state.url)
+        except Exception as e:
+            # Any error only loses this page, not the whole run
+            if isinstance(e, URL_ERRORS):
+                log_url_error(state.url, e)
+            else:
+                logger.exception(f"Failed to crawl event {state.url}")
+            self.policy.record_failure(state, utcnow())
+            stats.failed += 1
+            return False
+        stats.events += 1
+        if self.policy.record(state, utcnow(), content_hash(blocks)):
+            stats.events_changed += 1
+            logger.info(f"Event page changed: {state.url}")
+            return True
+        return False
+
+    async def extract_new(
+        self,
+        session: Session,
+        specs: dict[UUID, VenueSpec],
+        states: list[CrawlState],
+        stats: CrawlStats,
+    ) -> None:
+        await self.extract(session, specs, states)
+        stats.new_urls += len(states)
+        extracted = Event.known_urls(session, (state.url for state in states))
+        now = utcnow()
+        for state in states:
+            if state.url in extracted:
+                # The first recheck takes the baseline hash
+                state.last_fetched_at = now
+                state.failures = 0
+                state.next_fetch_at = now + self.policy.initial_interval
+            else:
+                self.policy.record_failure(state, now)
+                stats.failed += 1
+
+    async def extract(
+        self,
+        session: Session,
+        specs: dict[UUID, VenueSpec],
+        states: list[CrawlState],
+        refresh: bool = False,
+    ) -> None:
+        # Changed pages are fetched again, usually answered with a 304 since
+        # `fetch_event` just stored their validators, in full when the host
+        # sends none
+        venue_urls: dict[UUID, set[HttpUrl]] = {}
+        for state in states:
+            venue_urls.setdefault(state.venue_id, set()).add(state.url)
+        async with (
+            JobLedger(self.engine) as ledger,
+            EventWriter(
+                self.engine,
+                on_commit=self.cache.bump_data_version,
+                on_written=ledger.committed,
+                on_failed=ledger.not_committed,
+            ) as event_writer,
+        ):
+            await extract_events_from_venues(
+                self.http_session,
+                session,
+                event_writer,
+                self.cache,
+                self.event_data_extractor,
+                [specs[venue_id] for venue_id in venue_urls],
+                self.rate_limiter,
+                self.parser,
+                self.cpu_pool,
+                ledger,
+                venue_urls=venue_urls,
+                refresh=refresh,
+            )
+
+
+async def main(
+    venue_slugs: list[str] | None = None,
+    daemon: bool = False,
+    budget: int = DEFAULT_BUDGET,
+    interval: timedelta = timedelta(minutes=DEFAULT_INTERVAL_MINUTES),
+    parser_name: str = DEFAULT_PARSER,
+    cpu_workers: int = DEFAULT_CPU_WORKERS,
+):
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s: %(message)s",
+        datefmt="%y/%m/%d %H:%M:%S",
+    )
+
+    engine = initialize_sqlmodel()
+    cache = initialize_cache()
+    event_data_extractor = EventDataExtractor(
+        initialize_instructor_groq(),
+        model=INSTRUCTOR_MODEL,
+        concurrency=initialize_llm_concurrency(),
+    )
+    cpu_pool = CpuPool(cpu_workers)
+
+    headers = {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)",
+        "Accept": "text/html,application/xhtml+xml,application/xml;"
+        "q=0.9,image/webp,*/*;q=0.8",
+        "Accept-Language": "en-US,en;q=0.5",
+        "Connection": "keep-alive",
+    }
+
+    with Session(engine) as db_session:
+        Venue.seed_from_yaml(db_session, Path("./seeders/venues.yaml"))
+        VenueSpec.seed_from_yaml(db_session, Path("./seeders/specs.yaml"))
+        venue_specs = db_session.exec(select(VenueSpec)).all()
+        if venue_slugs is not None:
+            venue_specs = [
+                venue_spec
+                for venue_spec in venue_specs
+                if venue_spec.venue.slug in venue_slugs
+            ]
+
+        async with aiohttp.ClientSession(headers=headers) as http_session:
+            crawler = Crawler(
+                engine,
+                http_session,
+                cache,
+                event_data_extractor,
+                HostRateLimiter(),
+                get_parser(parser_name),
+                cpu_pool,
+                budget=budget,
+            )
+            while True:
+                try:
+                    await crawler.run_once(db_session, venue_specs)
+                except Exception:
+                    if not daemon:
+                        raise
+                    # A failed run leaves its pages due, the next one retries
+                    logger.exception("Crawl run failed")
+                    db_session.rollback()
+                if not daemon:
+                    break
+                # Runs with nothing due cost a query, the budget caps the rest
+                await asyncio.sleep(interval.total_seconds())
+    cpu_pool.close()
+    await cache.close()
@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import time
+from itertools import groupby
+from typing import Awaitable, Callable
+
+from pydantic import HttpUrl
+from sqlalchemy import Engine, delete, insert, select, update
+from sqlmodel import Session
+
+from ..models import Event, EventDateTime, Occurrence, Venue
+
+logger = logging.getLogger(__name__)
+
+
+class EventWriter:
+    """Writes queued events in batches from a single background task.
+
+    `on_written` gets the urls of every committed batch, `on_failed` each url
+    whose events couldn't be written, with the error.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        batch_size: int = 100,
+        flush_interval: float = 0.5,
+        on_commit: Callable[[], Awaitable[object]] | None = None,
+        max_queued: int = 1000,
+        on_written: Callable[[set[HttpUrl]], None] | None = None,
+        on_failed: Callable[[HttpUrl, Exception], None] | None = None,
+    ) -> None:
+        self.engine = engine
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_commit = on_commit
+        self.on_written = on_written
+        self.on_failed = on_failed
+        # Bounded so extraction waits for the database instead of piling up
+        self.queue: asyncio.Queue[Event | None] = asyncio.Queue(max_queued)
+        self.task: asyncio.Task[None] | None = None
+        self.written = 0
+        self.failed = 0
+
+    async def __aenter__(self) -> "EventWriter":
+        self.task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        await self.close()
+
+    async def write(self, events: list[Event]) -> None:
+        assert self.task is not None, "EventWriter used outside its context"
+        for event in events:
+            await self.queue.put(event)
+
+    async def close(self) -> None:
+        if self.task is None:
+            return
+        await self.queue.put(None)
+        await self.task
+        self.task = None
+        logger.info(
+            f"EventWriter wrote {self.written} events, {self.failed} urls failed"
+        )
+
+    async def _run(self) -> None:
+        closing = False
+        while not closing:
+            event = await self.queue.get()
+            if event is None:
+                break
+            batch = [event]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    event = await asyncio.wait_for(
+                        self.queue.get(), deadline - time.monotonic()
+                    )
+                except TimeoutError:
+                    break
+                if event is None:
+                    closing = True
+                    break
+                batch.append(event)
+            await self._flush(batch)
+
+    async def _flush(self, batch: list[Event]) -> None:
+        if not batch:
+            return
+        start = time.monotonic()
+        failed: dict[HttpUrl, Exception] = {}
+        try:
+            await asyncio.to_thread(self._insert, batch)
+        except Exception as e:
+            logger.warning(
+                f"Failed to commit {len(batch)} events, retrying by url: {e}"
+            )
+            failed = await asyncio.to_thread(self._insert_each, batch)
+        for url, e in failed.items():
+            logger.error(f"Failed to commit events from {url}: {e}")
+            if self.on_failed is not None:
+                self.on_failed(url, e)
+        self.failed += len(failed)
+        written = [event for event in batch if event.url not in failed]
+        if not written:
+            return
+        self.written += len(written)
+        logger.info(
+            f"Committed {len(written)} events in {time.monotonic() - start:.3f}s"
+        )
+        if self.on_written is not None:
+            self.on_written({event.url for event in written})
+        if self.on_commit is not None:
+            try:
+                await self.on_commit()
+            except Exception as e:
+                logger.error(f"Commit hook failed after {len(batch)} events: {e}")
+
+    def _insert_each(self, batch: list[Event]) -> dict[HttpUrl, Exception]:
+        # One transaction per url, a bad row only loses the url it came from
+        failed: dict[HttpUrl, Exception] = {}
+        by_url = sorted(batch, key=lambda event: str(event.url))
+        for url, events in groupby(by_url, key=lambda event: event.url):
+            try:
+                self._insert(list(events))
+            except Exception as e:
+                failed[url] = e
+        return failed
+
+    def _insert(self, batch: list[Event]) -> None:
+        # Events are upserted by url: a refreshed event keeps its id and gets
+        # its schedule replaced. The last extraction of a url in a batch wins
+        batch = list({event.url: event for event in batch}.values())
+        with Session(self.engine) as session:
+            existing = dict(
+                session.execute(
+                    select(Event.url, Event.id).where(
+                        Event.url.in_(  # type: ignore[attr-defined]
+                            [event.url for event in batch]
+                        )
+                    )
+                ).all()
+            )
+            for event in batch:
+                if event.url in existing:
+                    event.id = existing[event.url]
+            events = [
+                event.model_dump(exclude={"schedule", "venue"}) for event in batch
+            ]
+            datetimes = [
+                event_datetime.model_dump(exclude={"event"}) | {"event_id": event.id}
+                for event in batch
+                for event_datetime in event.schedule
+            ]
+            venue_ids = {event.venue_id for event in batch}
+            venues = {
+                venue.id: venue
+                for venue in session.execute(
+                    select(Venue.id, Venue.slug, Venue.name).where(
+                        Venue.id.in_(venue_ids)  # type: ignore[attr-defined]
+                    )
+                )
+            }
+            occurrences = [
+                Occurrence.values(
+                    event,
+                    event_datetime,
+                    venues[event.venue_id].slug,
+                    venues[event.venue_id].name,
+                )
+                for event in batch
+                for event_datetime in event.schedule
+            ]
+            if replaced := set(existing.values()):
+                for model in (Occurrence, EventDateTime):
+                    session.execute(
+                        delete(model).where(
+                            model.event_id.in_(replaced)  # type: ignore[attr-defined]
+                        )
+                    )
+                session.execute(
+                    update(Event),
+                    [values for values in events if values["id"] in replaced],
+                )
+            inserted = [values for values in events if values["url"] not in existing]
+            if inserted:
+                session.execute(insert(Event), inserted)
+            if datetimes:
+                session.execute(insert(EventDateTime), datetimes)
+                session.execute(insert(Occurrence), occurrences)
+            session.commit()
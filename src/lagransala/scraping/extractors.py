@@ -1,16 +1,28 @@
-import asyncio
 import logging
 from datetime import date
+from typing import Any
 
+import anthropic
+import groq
 from instructor import AsyncInstructor
+from instructor.core import InstructorRetryException
 from langfuse import Langfuse
 from langfuse.decorators import langfuse_context, observe
 from pydantic import HttpUrl
-from redis import StrictRedis
-from tenacity import AsyncRetrying, stop_after_attempt, wait_random_exponential
+from tenacity import (
+    AsyncRetrying,
+    RetryError,
+    retry_if_not_exception_type,
+    stop_after_attempt,
+    wait_random_exponential,
+)
 
+from ..cache import CacheNamespace
 from ..models import ContentBlock, SingleExtraction
+from ..utils.content_hash import content_hash
 from ..utils.http_url_key import http_url_key
+from .completions import USER_PROMPT_TEMPLATE, completion_body, parse_completion
+from .llm_concurrency import AdaptiveConcurrencyController, estimate_tokens
 
 logger = logging.getLogger(__name__)
 
@@ -19,79 +31,159 @@ langfuse = Langfuse()
 extractor_prompt = langfuse.get_prompt("event_extractor")
 
 
+RATE_LIMIT_ERRORS = (groq.RateLimitError, anthropic.RateLimitError)
+
+
+def provider_error(e: InstructorRetryException) -> Exception:
+    # The error of the last attempt, what older instructor raised as is
+    cause = e.__cause__
+    if isinstance(cause, RetryError):
+        cause = cause.last_attempt.exception()
+    return cause if isinstance(cause, Exception) else e
+
+
 class EventDataExtractor:
     def __init__(
         self,
         client: AsyncInstructor,
-        redis: StrictRedis,
         model: str,
-        max_concurrency: int = 1,
+        concurrency: AdaptiveConcurrencyController,
+        max_tokens: int = 2048,
+        max_rate_limit_retries: int = 5,
     ):
         self.client = client
-        self.redis = redis
-        self.redis_key = f"event_data_extractor:{model}"
         self.model = model
-        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.concurrency = concurrency
+        self.max_tokens = max_tokens
+        self.max_rate_limit_retries = max_rate_limit_retries
+
+    def content_key(
+        self, cache: CacheNamespace, content_blocks: list[ContentBlock]
+    ) -> str:
+        return cache.key(
+            f"{self.model}:p{extractor_prompt.version}:{content_hash(content_blocks)}"
+        )
+
+    def url_key(self, cache: CacheNamespace, url: HttpUrl) -> str:
+        # Secondary index pointing at the content key of the last extraction
+        return cache.key(f"{self.model}:url:{http_url_key(url)}")
+
+    def estimate_tokens(self, content_blocks: list[ContentBlock]) -> int:
+        prompt = extractor_prompt.prompt + USER_PROMPT_TEMPLATE
+        for block in content_blocks:
+            prompt += block.spec.relevant + (block.spec.irrelevant or "")
+            prompt += block.content or ""
+        return estimate_tokens(prompt) + self.max_tokens
+
+    async def cached(
+        self,
+        url: HttpUrl,
+        content_blocks: list[ContentBlock],
+        cache: CacheNamespace,
+    ) -> SingleExtraction | None:
+        key = self.content_key(cache, content_blocks)
+        if data := await cache.get(key):
+            logger.debug(f"CacheHit: {key}")
+            await cache.set(self.url_key(cache, url), key)
+            return SingleExtraction.model_validate_json(data)
+        return None
+
+    async def store(
+        self,
+        url: HttpUrl,
+        content_blocks: list[ContentBlock],
+        cache: CacheNamespace,
+        extraction_data: SingleExtraction,
+    ) -> None:
+        key = self.content_key(cache, content_blocks)
+        await cache.set_many(
+            {key: extraction_data.model_dump_json(), self.url_key(cache, url): key}
+        )
+
+    def batch_body(self, content_blocks: list[ContentBlock]) -> dict[str, Any]:
+        return completion_body(
+            self.model, self.max_tokens, extractor_prompt.prompt, content_blocks
+        )
+
+    parse_completion = staticmethod(parse_completion)
 
     @observe(as_type="generation")
     async def __call__(
+        self,
+        url: HttpUrl,
+        content_blocks: list[ContentBlock],
+        cache: CacheNamespace,
+    ) -> SingleExtraction:
+        if (cached := await self.cached(url, content_blocks, cache)) is not None:
+            return cached
+
+        tokens = self.estimate_tokens(content_blocks)
+        retries = 0
+        while True:
+            async with self.concurrency.slot(tokens):
+                try:
+                    extraction_data = await self._extract(url, content_blocks)
+                except RATE_LIMIT_ERRORS:
+                    # The client's response hook already paused the controller,
+                    # the next slot waits for it
+                    retries += 1
+                    if retries > self.max_rate_limit_retries:
+                        raise
+                    logger.warning(
+                        f"Rate limited while extracting from {url}, "
+                        f"retry {retries}/{self.max_rate_limit_retries}"
+                    )
+                    continue
+            await self.store(url, content_blocks, cache, extraction_data)
+            return extraction_data
+
+    async def _extract(
         self, url: HttpUrl, content_blocks: list[ContentBlock]
     ) -> SingleExtraction:
-        key = f"{self.redis_key}:{http_url_key(url)}"
-        if data := self.redis.get(key):
-            logger.debug(f"CacheHit: {key}")
-            extraction_data = SingleExtraction.model_validate_json(data)
-        else:
-            async with self.semaphore:  # TODO: Make this based on rate limiting
-                langfuse_context.update_current_trace(release="v2")
+        langfuse_context.update_current_trace(release="v2")
 
-                langfuse_context.update_current_observation(
-                    input=content_blocks,
+        langfuse_context.update_current_observation(
+            input=content_blocks,
+            model=self.model,
+            prompt=extractor_prompt,
+        )
+        logger.info(f"Extracting event data from {url}")
+        try:
+            extraction_data, completion = (
+                await self.client.chat.completions.create_with_completion(
                     model=self.model,
-                    prompt=extractor_prompt,
-                )
-                logger.info(f"Extracting event data from {url}")
-                extraction_data, completion = (
-                    await self.client.chat.completions.create_with_completion(
-                        model=self.model,
-                        max_tokens=2048,
-                        messages=[
-                            {
-                                "role": "system",
-                                "content": extractor_prompt.prompt,
-                            },
-                            {
-                                "role": "user",
-                                "content": """
-                            {% for block in blocks %}
-                            <block>
-                                <relevant>{{ block.relevant }}</relevant>
-                                {% if block.irrelevant %}
-                                <irrelevant>{{ block.irrelevant }}</irrelevant>
-                                {% endif %}
-                                <content>{{ block.content }}</content>
-                            </block>
-                            {% endfor %}
-                            """,
-                            },
-                        ],
-                        response_model=SingleExtraction,
-                        context={
-                            "blocks": content_blocks,
-                            "current_year": date.today().year,
+                    max_tokens=self.max_tokens,
+                    messages=[
+                        {
+                            "role": "system",
+                            "content": extractor_prompt.prompt,
                         },
-                        max_retries=AsyncRetrying(
-                            wait=wait_random_exponential(multiplier=10, min=5, max=120),
-                            stop=stop_after_attempt(3),
-                            reraise=True,
-                        ),
-                    )
+                        {
+                            "role": "user",
+                            "content": USER_PROMPT_TEMPLATE,
+                        },
+                    ],
+                    response_model=SingleExtraction,
+                    context={
+                        "blocks": content_blocks,
+                        "current_year": date.today().year,
+                    },
+                    max_retries=AsyncRetrying(
+                        wait=wait_random_exponential(multiplier=10, min=5, max=120),
+                        stop=stop_after_attempt(3),
+                        # Rate limits are handled by the concurrency controller
+                        retry=retry_if_not_exception_type(RATE_LIMIT_ERRORS),
+                        reraise=True,
+                    ),
                 )
-                self.redis.set(key, extraction_data.model_dump_json())
-                # langfuse_context.update_current_observation(
-                #     usage_details={
-                #         "input_tokens": completion.usage.input_tokens,
-                #         "output_tokens": completion.usage.output_tokens,
-                #     }
-                # )
+            )
+        except InstructorRetryException as e:
+            # Newer instructor wraps the provider's error, callers match on it
+            raise provider_error(e) from e
+        # langfuse_context.update_current_observation(
+        #     usage_details={
+        #         "input_tokens": completion.usage.input_tokens,
+        #         "output_tokens": completion.usage.output_tokens,
+        #     }
+        # )
         return extraction_data
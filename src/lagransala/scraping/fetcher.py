@@ -0,0 +1,158 @@
+import logging
+import re
+
+import aiohttp
+from pydantic import BaseModel, HttpUrl
+
+from ..cache import CacheNamespace
+from ..utils.http_url_key import http_url_key
+from .parsers import IncrementalParse
+from .rate_limit import HostRateLimiter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 5 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+
+_META_CHARSET = re.compile(rb"""<meta[^>]+charset=["']?([\w-]+)""", re.IGNORECASE)
+
+
+class UnsupportedContentError(Exception):
+    def __init__(self, url: HttpUrl, content_type: str) -> None:
+        super().__init__(f"Skipping {url}: unsupported content type `{content_type}`")
+        self.url = url
+        self.content_type = content_type
+
+
+class HttpStatusError(Exception):
+    def __init__(self, url: HttpUrl, status: int) -> None:
+        super().__init__(f"HTTP {status} from {url}")
+        self.url = url
+        self.status = status
+
+
+class TransientStatusError(HttpStatusError):
+    # Statuses worth trying again later, the page itself may be fine
+    STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+
+def _decode(body: bytes, charset: str | None) -> str:
+    if charset is None and (match := _META_CHARSET.search(body[:4096])):
+        charset = match.group(1).decode("ascii")
+    try:
+        return body.decode(charset or "utf-8", errors="replace")
+    except LookupError:
+        return body.decode("utf-8", errors="replace")
+
+
+class Validators(BaseModel):
+    etag: str | None = None
+    last_modified: str | None = None
+
+    @property
+    def headers(self) -> dict[str, str]:
+        headers: dict[str, str] = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class FetchResult(BaseModel):
+    url: HttpUrl
+    status: int
+    text: str | None = None
+
+    @property
+    def not_modified(self) -> bool:
+        return self.status == 304
+
+
+class HtmlFetcher:
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        cache: CacheNamespace,
+        rate_limiter: HostRateLimiter,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        timeout: float = 30,
+        revalidate: bool = False,
+    ) -> None:
+        self.session = session
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self.max_bytes = max_bytes
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        # Check cached pages with the host even when there's no validator
+        self.revalidate = revalidate
+
+    async def fetch(
+        self,
+        url: HttpUrl,
+        validators: Validators | None = None,
+        until: IncrementalParse | None = None,
+    ) -> FetchResult:
+        headers = validators.headers if validators else {}
+        async with self.rate_limiter.limit(url):
+            logger.info(f"Fetch html from {url}")
+            async with self.session.get(
+                str(url), headers=headers, timeout=self.timeout
+            ) as response:
+                if response.status == 304:
+                    logger.debug(f"NotModified: {url}")
+                    return FetchResult(url=url, status=response.status)
+                # Error pages are never content, callers keep what they had
+                if not response.ok:
+                    if response.status in TransientStatusError.STATUSES:
+                        raise TransientStatusError(url, response.status)
+                    raise HttpStatusError(url, response.status)
+                # Without the header aiohttp reports application/octet-stream,
+                # only pages declaring another type are rejected
+                if (
+                    "Content-Type" in response.headers
+                    and response.content_type not in HTML_CONTENT_TYPES
+                ):
+                    raise UnsupportedContentError(url, response.content_type)
+                text = await self._read(response, until)
+                new_validators = Validators(
+                    etag=response.headers.get("ETag"),
+                    last_modified=response.headers.get("Last-Modified"),
+                )
+                status = response.status
+        if new_validators.etag or new_validators.last_modified:
+            await self.cache.set(self._key(url), new_validators.model_dump_json())
+        return FetchResult(url=url, status=status, text=text)
+
+    async def _read(
+        self, response: aiohttp.ClientResponse, until: IncrementalParse | None
+    ) -> str:
+        body = bytearray()
+        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+            body += chunk
+            if len(body) >= self.max_bytes:
+                logger.warning(
+                    f"Truncating {response.url} at {self.max_bytes} bytes budget"
+                )
+                del body[self.max_bytes :]
+                break
+            if until is not None and until.feed(chunk):
+                logger.debug(f"All blocks found in {response.url} after {len(body)}B")
+                break
+        return _decode(bytes(body), response.charset)
+
+    async def fetch_if_modified(
+        self, url: HttpUrl, until: IncrementalParse | None = None
+    ) -> FetchResult | None:
+        # Without stored validators there is nothing to revalidate against, so
+        # the caller's cached copy is used as is, or with `revalidate` the page
+        # is fetched again in full
+        data = await self.cache.get(self._key(url))
+        if not data:
+            return await self.fetch(url, until=until) if self.revalidate else None
+        result = await self.fetch(url, Validators.model_validate_json(data), until)
+        return None if result.not_modified else result
+
+    def _key(self, url: HttpUrl) -> str:
+        return self.cache.key(http_url_key(url))
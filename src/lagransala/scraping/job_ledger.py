@@ -0,0 +1,237 @@
+import asyncio
+import logging
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Iterable
+from uuid import UUID
+
+import aiohttp
+import groq
+from pydantic import HttpUrl
+from sqlalchemy import Engine
+from sqlalchemy.dialects.sqlite import insert
+from sqlmodel import Session, col, select
+
+from ..models import ExtractionJob, JobState
+from .batch import BatchIncompleteError
+from .fetcher import TransientStatusError
+
+logger = logging.getLogger(__name__)
+
+# Failures that may go away by themselves, anything else is permanent
+TRANSIENT_ERRORS = (
+    aiohttp.ClientConnectorError,
+    TimeoutError,
+    groq.APIConnectionError,
+    groq.InternalServerError,
+    groq.RateLimitError,
+    TransientStatusError,
+    BatchIncompleteError,
+)
+
+DEFAULT_MAX_ATTEMPTS = 5
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class JobLedger:
+    """Keeps the `ExtractionJob` of every url in the current run.
+
+    State changes are kept in memory and written in batches every
+    `flush_interval` seconds, a crash loses at most that much progress and
+    those urls are simply resumed as pending or fetched.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        flush_interval: float = 2,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        backoff: timedelta = timedelta(minutes=5),
+        max_backoff: timedelta = timedelta(days=1),
+    ) -> None:
+        self.engine = engine
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jobs: dict[HttpUrl, ExtractionJob] = {}
+        self.dirty: set[HttpUrl] = set()
+        self.task: asyncio.Task[None] | None = None
+
+    async def __aenter__(self) -> "JobLedger":
+        self.task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        await self.flush()
+
+    def _load(self, urls: list[HttpUrl], batch_size: int = 500) -> None:
+        with Session(self.engine, expire_on_commit=False) as session:
+            for i in range(0, len(urls), batch_size):
+                query = select(ExtractionJob).where(
+                    col(ExtractionJob.url).in_(  # type: ignore[arg-type]
+                        urls[i : i + batch_size]
+                    )
+                )
+                for job in session.exec(query).all():
+                    session.expunge(job)
+                    self.jobs[job.url] = job
+
+    async def enqueue(self, venue_id: UUID, urls: Iterable[HttpUrl]) -> set[HttpUrl]:
+        """Mark `urls` pending, returns those not failed before.
+
+        Failed urls are left alone, `retry` decides when they run again.
+        """
+        urls = set(urls)
+        await asyncio.to_thread(self._load, [u for u in urls if u not in self.jobs])
+        now = utcnow()
+        accepted: set[HttpUrl] = set()
+        for url in urls:
+            job = self.jobs.get(url)
+            if job is None:
+                job = self.jobs[url] = ExtractionJob(
+                    venue_id=venue_id, url=url, state=JobState.PENDING, updated_at=now
+                )
+            elif job.state == JobState.FAILED:
+                continue
+            job.state = JobState.PENDING
+            job.updated_at = now
+            self.dirty.add(url)
+            accepted.add(url)
+        return accepted
+
+    def unfinished(self, venue_id: UUID) -> set[HttpUrl]:
+        # Urls a previous run queued and never finished
+        with Session(self.engine) as session:
+            return set(
+                session.exec(
+                    select(ExtractionJob.url).where(
+                        ExtractionJob.venue_id == venue_id,
+                        col(ExtractionJob.state).in_(
+                            [JobState.PENDING, JobState.FETCHED]
+                        ),
+                    )
+                ).all()
+            )
+
+    def requeue(
+        self, venue_ids: Iterable[UUID] | None = None
+    ) -> dict[UUID, set[HttpUrl]]:
+        """Set due transient failures back to pending, by venue."""
+        now = utcnow()
+        query = select(ExtractionJob).where(
+            ExtractionJob.state == JobState.FAILED,
+            col(ExtractionJob.transient).is_(True),
+            col(ExtractionJob.next_attempt_at) <= now,
+        )
+        if venue_ids is not None:
+            query = query.where(col(ExtractionJob.venue_id).in_(list(venue_ids)))
+        venue_urls: dict[UUID, set[HttpUrl]] = {}
+        with Session(self.engine) as session:
+            for job in session.exec(query).all():
+                job.state = JobState.PENDING
+                job.updated_at = now
+                venue_urls.setdefault(job.venue_id, set()).add(job.url)
+            session.commit()
+        return venue_urls
+
+    def counts(self, venue_ids: Iterable[UUID] | None = None) -> dict[str, int]:
+        now = utcnow()
+        query = select(ExtractionJob)
+        if venue_ids is not None:
+            query = query.where(col(ExtractionJob.venue_id).in_(list(venue_ids)))
+        counts: dict[str, int] = {}
+        with Session(self.engine) as session:
+            for job in session.exec(
+                query.where(ExtractionJob.state == JobState.FAILED)
+            ):
+                if not job.transient:
+                    key = "permanent"
+                elif job.next_attempt_at is not None and job.next_attempt_at > now:
+                    key = "backing off"
+                else:
+                    key = "due"
+                counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    def _update(self, url: HttpUrl, state: JobState) -> ExtractionJob | None:
+        job = self.jobs.get(url)
+        if job is None:
+            return None
+        job.state = state
+        job.updated_at = utcnow()
+        self.dirty.add(url)
+        return job
+
+    def fetched(self, url: HttpUrl) -> None:
+        self._update(url, JobState.FETCHED)
+
+    def extracted(self, url: HttpUrl) -> None:
+        if job := self._update(url, JobState.EXTRACTED):
+            job.error = None
+            job.next_attempt_at = None
+
+    def committed(self, urls: set[HttpUrl]) -> None:
+        # The `EventWriter` wrote the events of `urls` to the database
+        for url in urls:
+            self.extracted(url)
+
+    def not_committed(self, url: HttpUrl, e: Exception) -> None:
+        # Whatever broke the write, extracting again may well get through
+        self.failed(url, e, transient=True)
+
+    def failed(self, url: HttpUrl, e: Exception, transient: bool | None = None) -> None:
+        job = self._update(url, JobState.FAILED)
+        if job is None:
+            return
+        job.attempts += 1
+        job.error = f"{type(e).__name__}: {e}"[:1000]
+        if transient is None:
+            transient = isinstance(e, TRANSIENT_ERRORS)
+        job.transient = transient and job.attempts < self.max_attempts
+        job.next_attempt_at = (
+            job.updated_at + self.backoff_for(job.attempts) if job.transient else None
+        )
+
+    def backoff_for(self, attempts: int) -> timedelta:
+        # Exponential with jitter, so urls failing together don't retry together
+        backoff = min(self.max_backoff, self.backoff * 2 ** (attempts - 1))
+        return backoff * random.uniform(0.5, 1)
+
+    def _write(self, jobs: list[ExtractionJob], batch_size: int = 500) -> None:
+        with Session(self.engine) as session:
+            for i in range(0, len(jobs), batch_size):
+                values = [job.model_dump() for job in jobs[i : i + batch_size]]
+                statement = insert(ExtractionJob).values(values)
+                statement = statement.on_conflict_do_update(
+                    index_elements=["url"],
+                    set_={
+                        column: statement.excluded[column]
+                        for column in values[0]
+                        if column not in ("id", "url")
+                    },
+                )
+                session.execute(statement)
+            session.commit()
+
+    async def flush(self) -> None:
+        if not self.dirty:
+            return
+        jobs = [self.jobs[url] for url in self.dirty]
+        self.dirty = set()
+        try:
+            await asyncio.to_thread(self._write, jobs)
+        except Exception as e:
+            logger.error(f"Failed to update {len(jobs)} extraction jobs: {e}")
+            self.dirty.update(job.url for job in jobs)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import re
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import AsyncIterator, Mapping
+
+logger = logging.getLogger(__name__)
+
+# Rough chars/token ratio, good enough to budget prompts before sending them
+CHARS_PER_TOKEN = 4
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def parse_reset(value: str | None) -> float | None:
+    """Parse a rate-limit reset header into seconds from now.
+
+    Accepts plain seconds (`retry-after`), Groq/OpenAI style durations
+    (`2m59.56s`, `120ms`) and Anthropic style RFC 3339 timestamps.
+    """
+    if value is None:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if parts and "".join(n + u for n, u in parts) == value:
+        return sum(float(n) * _DURATION_UNITS[u] for n, u in parts)
+    try:
+        reset_at = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        logger.warning(f"Unable to parse rate limit reset `{value}`")
+        return None
+    return max(0.0, reset_at.timestamp() - time.time())
+
+
+def _header_int(headers: Mapping[str, str], *names: str) -> int | None:
+    for name in names:
+        if (value := headers.get(name)) is not None:
+            try:
+                return int(float(value))
+            except ValueError:
+                return None
+    return None
+
+
+def _header_reset(headers: Mapping[str, str], *names: str) -> float | None:
+    for name in names:
+        if (value := headers.get(name)) is not None:
+            return parse_reset(value)
+    return None
+
+
+class AdaptiveConcurrencyController:
+    def __init__(
+        self,
+        initial_concurrency: int = 2,
+        min_concurrency: int = 1,
+        max_concurrency: int = 16,
+        headroom: float = 0.9,
+        default_pause: float = 10.0,
+    ) -> None:
+        self.limit = initial_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.headroom = headroom
+        self.default_pause = default_pause
+
+        self.in_flight = 0
+        self.reserved_tokens = 0
+        self.mean_tokens: float | None = None
+        self.paused_until = 0.0
+
+        self.remaining_requests: int | None = None
+        self.remaining_tokens: int | None = None
+        self.requests_reset_at = 0.0
+        self.tokens_reset_at = 0.0
+
+        self.condition = asyncio.Condition()
+
+    def _delay(self, tokens: int) -> float | None:
+        """Seconds to wait before a request of `tokens` may start.
+
+        `0` means it can start now, `None` means it has to wait for an
+        in-flight request to finish.
+        """
+        now = time.monotonic()
+        if self.paused_until > now:
+            return self.paused_until - now
+        if self.in_flight >= self.limit:
+            return None
+        if self.remaining_requests is not None and self.requests_reset_at > now:
+            if self.in_flight >= self.remaining_requests:
+                return (self.requests_reset_at - now) if not self.in_flight else None
+        if self.remaining_tokens is not None and self.tokens_reset_at > now:
+            budget = self.remaining_tokens * self.headroom - self.reserved_tokens
+            if tokens > budget:
+                return (self.tokens_reset_at - now) if not self.in_flight else None
+        return 0
+
+    @asynccontextmanager
+    async def slot(self, tokens: int) -> AsyncIterator[None]:
+        start = time.monotonic()
+        async with self.condition:
+            while (delay := self._delay(tokens)) != 0:
+                try:
+                    await asyncio.wait_for(self.condition.wait(), timeout=delay)
+                except TimeoutError:
+                    pass
+            self.in_flight += 1
+            self.reserved_tokens += tokens
+        wait = time.monotonic() - start
+        if wait > 1:
+            logger.debug(f"Waited {wait:.2f}s for an LLM slot ({tokens} tokens)")
+        self.mean_tokens = (
+            tokens
+            if self.mean_tokens is None
+            else 0.8 * self.mean_tokens + 0.2 * tokens
+        )
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.in_flight -= 1
+                self.reserved_tokens -= tokens
+                self.condition.notify_all()
+
+    async def update_from_headers(self, headers: Mapping[str, str]) -> None:
+        now = time.monotonic()
+        remaining_requests = _header_int(
+            headers,
+            "x-ratelimit-remaining-requests",
+            "anthropic-ratelimit-requests-remaining",
+        )
+        remaining_tokens = _header_int(
+            headers,
+            "x-ratelimit-remaining-tokens",
+            "anthropic-ratelimit-tokens-remaining",
+        )
+        requests_reset = _header_reset(
+            headers, "x-ratelimit-reset-requests", "anthropic-ratelimit-requests-reset"
+        )
+        tokens_reset = _header_reset(
+            headers, "x-ratelimit-reset-tokens", "anthropic-ratelimit-tokens-reset"
+        )
+        if remaining_requests is not None:
+            self.remaining_requests = remaining_requests
+            self.requests_reset_at = now + (requests_reset or 0)
+        if remaining_tokens is not None:
+            self.remaining_tokens = remaining_tokens
+            self.tokens_reset_at = now + (tokens_reset or 0)
+        self._adapt()
+        await self._notify()
+
+    async def on_rate_limited(self, retry_after: float | None = None) -> None:
+        pause = retry_after if retry_after is not None else self.default_pause
+        self.paused_until = max(self.paused_until, time.monotonic() + pause)
+        self.limit = max(self.min_concurrency, self.limit // 2)
+        logger.warning(
+            f"LLM rate limited, pausing for {pause:.1f}s "
+            f"(concurrency limit {self.limit})"
+        )
+        await self._notify()
+
+    def _adapt(self) -> None:
+        if self.remaining_tokens is None or self.mean_tokens is None:
+            return
+        budget = self.remaining_tokens * self.headroom - self.reserved_tokens
+        requests_left = (
+            self.remaining_requests
+            if self.remaining_requests is not None
+            else self.max_concurrency
+        )
+        previous = self.limit
+        if budget >= self.mean_tokens * (self.limit + 1) and requests_left > self.limit:
+            self.limit = min(self.max_concurrency, self.limit + 1)
+        elif budget < self.mean_tokens * self.limit:
+            self.limit = max(self.min_concurrency, self.limit - 1)
+        if self.limit != previous:
+            logger.debug(f"LLM concurrency limit {previous} -> {self.limit}")
+
+    async def _notify(self) -> None:
+        async with self.condition:
+            self.condition.notify_all()
@@ -0,0 +1,178 @@
+import logging
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Callable
+
+from bs4 import BeautifulSoup
+
+logger = logging.getLogger(__name__)
+
+# Elements dropped before looking for content blocks
+NOISE_TAGS = ["script", "style", "nav", "header", "footer"]
+
+
+class IncrementalParse(ABC):
+    @abstractmethod
+    def feed(self, chunk: bytes) -> bool:
+        """Feed the next chunk, returns True once every selector was found."""
+        raise NotImplementedError()
+
+
+class HtmlParser(ABC):
+    name: str
+
+    @abstractmethod
+    def links(self, html: str) -> list[str]:
+        """Every `href` attribute value in the document, in document order."""
+        raise NotImplementedError()
+
+    @abstractmethod
+    def blocks(self, html: str, selectors: list[str]) -> list[str | None]:
+        """Outer HTML of the first element matching each selector."""
+        raise NotImplementedError()
+
+    def incremental(self, selectors: list[str]) -> IncrementalParse | None:
+        # Backends that can't parse incrementally always read the whole page
+        return None
+
+
+def _log_matches(selector: str, matches: int) -> None:
+    if matches > 1:
+        logger.info(
+            f"More than one block found with selector `{selector}` (using the first)"
+        )
+    elif matches == 0:
+        logger.info(f"Empty block found with selector `{selector}`")
+
+
+class BeautifulSoupParser(HtmlParser):
+    def __init__(self, features: str = "html.parser") -> None:
+        self.features = features
+        self.name = f"bs4-{features}"
+
+    def __reduce__(self):
+        return BeautifulSoupParser, (self.features,)
+
+    def links(self, html: str) -> list[str]:
+        soup = BeautifulSoup(html, self.features)
+        return [
+            href
+            for tag in soup.select("[href]")
+            if isinstance(href := tag.get("href"), str)
+        ]
+
+    def blocks(self, html: str, selectors: list[str]) -> list[str | None]:
+        soup = BeautifulSoup(html, self.features)
+        for element in soup.find_all(NOISE_TAGS):
+            element.decompose()
+        result: list[str | None] = []
+        for selector in selectors:
+            tags = soup.select(selector, limit=2)
+            _log_matches(selector, len(tags))
+            result.append(str(tags[0]) if tags else None)
+        return result
+
+
+class LxmlParser(HtmlParser):
+    name = "lxml"
+
+    def __init__(self) -> None:
+        import lxml.html
+
+        self.html = lxml.html
+        self.parser = lxml.html.HTMLParser(encoding="utf-8")
+
+    def __reduce__(self):
+        # Modules and lxml parsers don't pickle, a process pool gets a new one
+        return LxmlParser, ()
+
+    def _root(self, html: str):
+        if not html.strip():
+            return None
+        # Encode so documents declaring their own encoding are accepted
+        return self.html.fromstring(html.encode("utf-8"), parser=self.parser)
+
+    def links(self, html: str) -> list[str]:
+        root = self._root(html)
+        if root is None:
+            return []
+        return [str(href) for href in root.xpath("//@href")]
+
+    def blocks(self, html: str, selectors: list[str]) -> list[str | None]:
+        root = self._root(html)
+        if root is None:
+            return [None for _ in selectors]
+        for element in root.xpath(" | ".join(f"//{tag}" for tag in NOISE_TAGS)):
+            if element.getparent() is not None:
+                element.drop_tree()
+        result: list[str | None] = []
+        for selector in selectors:
+            elements = _css_selector(selector)(root)
+            _log_matches(selector, len(elements))
+            result.append(
+                self.html.tostring(elements[0], encoding="unicode", with_tail=False)
+                if elements
+                else None
+            )
+        return result
+
+    def incremental(self, selectors: list[str]) -> IncrementalParse | None:
+        return LxmlIncrementalParse(selectors)
+
+
+class LxmlIncrementalParse(IncrementalParse):
+    def __init__(self, selectors: list[str]) -> None:
+        from lxml import etree
+
+        self.parser = etree.HTMLPullParser(events=("end",))
+        self.pending = [_css_selector(selector) for selector in selectors]
+        self.closed: set = set()
+
+    def _found(self, selector, root) -> bool:
+        for element in selector(root):
+            # Same as a full parse: blocks inside noise tags get dropped
+            if element.xpath(NOISE_ANCESTORS):
+                continue
+            return element in self.closed
+        return False
+
+    def feed(self, chunk: bytes) -> bool:
+        self.parser.feed(chunk)
+        root = None
+        for _, element in self.parser.read_events():
+            self.closed.add(element)
+            root = element.getroottree().getroot()
+        if root is None:
+            return not self.pending
+        self.pending = [
+            selector for selector in self.pending if not self._found(selector, root)
+        ]
+        return not self.pending
+
+
+NOISE_ANCESTORS = " | ".join(f"ancestor-or-self::{tag}" for tag in NOISE_TAGS)
+
+
+@lru_cache(maxsize=None)
+def _css_selector(selector: str):
+    from lxml.cssselect import CSSSelector
+
+    return CSSSelector(selector)
+
+
+PARSERS: dict[str, Callable[[], HtmlParser]] = {
+    "html.parser": lambda: BeautifulSoupParser("html.parser"),
+    "bs4-lxml": lambda: BeautifulSoupParser("lxml"),
+    "lxml": LxmlParser,
+}
+
+DEFAULT_PARSER = "lxml"
+
+
+def get_parser(name: str = DEFAULT_PARSER) -> HtmlParser:
+    try:
+        return PARSERS[name]()
+    except KeyError:
+        raise ValueError(
+            f"Unknown parser `{name}`, available parsers: {', '.join(PARSERS)}"
+        )
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Generic, TypeVar
+
+from .cpu_pool import DEFAULT_CPU_WORKERS
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+DEFAULT_QUEUE_SIZE = 32
+
+# Extraction stages workers, page fetches use the scheduler's DEFAULT_WORKERS.
+# Parse workers hand pages to the CPU pool, twice its size keeps it busy.
+# The LLM stage is throttled by its concurrency controller anyway
+DEFAULT_PARSE_WORKERS = 2 * DEFAULT_CPU_WORKERS
+DEFAULT_EXTRACT_WORKERS = 16
+
+
+class Stage(Generic[T]):
+    """One step of a `Pipeline`, run by `workers` tasks reading from `queue`.
+
+    `handler` returns False to drop the item, the item is then done.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[T], Awaitable[bool]],
+        workers: int = 1,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+    ) -> None:
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.queue: asyncio.Queue[T | None] = asyncio.Queue(queue_size)
+        self.busy = 0
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.busy_time = 0.0
+        # Time spent waiting for room in the next stage's queue
+        self.blocked_time = 0.0
+
+    @property
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+    def summary(self) -> str:
+        return (
+            f"{self.name}: {self.processed} processed, {self.dropped} dropped, "
+            f"{self.failed} failed, {self.busy_time:.1f}s busy, "
+            f"{self.blocked_time:.1f}s blocked"
+        )
+
+
+class Pipeline(Generic[T]):
+    """Stages joined by bounded queues.
+
+    A full queue makes the previous stage wait, so a slow stage slows down
+    everything before it instead of piling up items in memory. An item whose
+    handler raised goes to `on_failed` with the error, then to `on_done`.
+    """
+
+    def __init__(
+        self,
+        stages: list[Stage[T]],
+        on_done: Callable[[T], Awaitable[None]] | None = None,
+        monitor_interval: float = 10,
+        on_failed: Callable[[T, Exception], Awaitable[None]] | None = None,
+    ) -> None:
+        self.stages = stages
+        self.on_done = on_done
+        self.on_failed = on_failed
+        self.monitor_interval = monitor_interval
+        self.tasks: list[list[asyncio.Task[None]]] = []
+        self.monitor: asyncio.Task[None] | None = None
+
+    async def __aenter__(self) -> "Pipeline[T]":
+        self.tasks = [
+            [
+                asyncio.create_task(self._work(i), name=f"{stage.name}-{n}")
+                for n in range(stage.workers)
+            ]
+            for i, stage in enumerate(self.stages)
+        ]
+        self.monitor = asyncio.create_task(self._monitor())
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        await self.close()
+
+    async def put(self, item: T) -> None:
+        await self.stages[0].queue.put(item)
+
+    def depths(self) -> dict[str, int]:
+        return {stage.name: stage.depth for stage in self.stages}
+
+    async def close(self) -> None:
+        # Stop stages front to back, so every item still queued gets through
+        for stage, tasks in zip(self.stages, self.tasks):
+            for _ in tasks:
+                await stage.queue.put(None)
+            await asyncio.gather(*tasks)
+        self.tasks = []
+        if self.monitor is not None:
+            self.monitor.cancel()
+            self.monitor = None
+        for stage in self.stages:
+            logger.info(f"Stage {stage.summary()}")
+
+    async def _work(self, index: int) -> None:
+        stage = self.stages[index]
+        following = self.stages[index + 1] if index + 1 < len(self.stages) else None
+        while (item := await stage.queue.get()) is not None:
+            stage.busy += 1
+            start = time.monotonic()
+            keep: bool | None = None
+            error: Exception | None = None
+            try:
+                keep = await stage.handler(item)
+            except Exception as e:
+                logger.exception(f"Stage {stage.name} failed")
+                stage.failed += 1
+                error = e
+            finally:
+                stage.busy -= 1
+                stage.busy_time += time.monotonic() - start
+            stage.processed += 1
+            if keep and following is not None:
+                start = time.monotonic()
+                await following.queue.put(item)
+                stage.blocked_time += time.monotonic() - start
+                continue
+            if keep is False:
+                stage.dropped += 1
+            if error is not None and self.on_failed is not None:
+                try:
+                    await self.on_failed(item, error)
+                except Exception:
+                    logger.exception(f"Failure hook of stage {stage.name} failed")
+            if self.on_done is not None:
+                await self.on_done(item)
+
+    async def _monitor(self) -> None:
+        while True:
+            await asyncio.sleep(self.monitor_interval)
+            logger.info(
+                "Pipeline queues: "
+                + ", ".join(
+                    f"{stage.name} {stage.depth}/{stage.queue.maxsize} "
+                    f"({stage.busy}/{stage.workers} busy)"
+                    for stage in self.stages
+                )
+            )
@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+from urllib.parse import urlsplit
+
+from pydantic import BaseModel, HttpUrl
+
+from ..models import VenueSpec
+
+logger = logging.getLogger(__name__)
+
+
+class HostLimits(BaseModel):
+    max_concurrency: int = 4
+    requests_per_second: float = 2.0
+
+
+class WaitStats(BaseModel):
+    requests: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+
+    @property
+    def mean_wait(self) -> float:
+        return self.total_wait / self.requests if self.requests else 0.0
+
+    def record(self, wait: float) -> None:
+        self.requests += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float | None = None) -> None:
+        assert rate > 0, "Token bucket rate must be positive"
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        # Waiters sleep while holding the lock so tokens are handed out in order
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class HostLimiter:
+    def __init__(self, host: str, limits: HostLimits) -> None:
+        self.host = host
+        self.limits = limits
+        self.semaphore = asyncio.Semaphore(limits.max_concurrency)
+        self.bucket = TokenBucket(limits.requests_per_second)
+        self.stats = WaitStats()
+
+    @asynccontextmanager
+    async def __call__(self) -> AsyncIterator[float]:
+        start = time.monotonic()
+        async with self.semaphore:
+            await self.bucket.acquire()
+            wait = time.monotonic() - start
+            self.stats.record(wait)
+            if wait > 1:
+                logger.debug(f"Waited {wait:.2f}s for {self.host}")
+            yield wait
+
+
+def url_host(url: HttpUrl | str) -> str:
+    return urlsplit(str(url)).netloc
+
+
+class HostRateLimiter:
+    def __init__(self, default_limits: HostLimits | None = None) -> None:
+        self.default_limits = default_limits or HostLimits()
+        self.limiters: dict[str, HostLimiter] = {}
+
+    def configure(self, host: str, limits: HostLimits) -> None:
+        limiter = self.limiters.get(host)
+        if limiter is not None and limiter.limits == limits:
+            return
+        if limiter is not None:
+            logger.warning(f"Reconfiguring rate limits for {host}: {limits}")
+        self.limiters[host] = HostLimiter(host, limits)
+
+    def configure_venue(self, venue_spec: VenueSpec) -> None:
+        limits = self.default_limits.model_copy(
+            update={
+                key: value
+                for key, value in {
+                    "max_concurrency": venue_spec.max_concurrency,
+                    "requests_per_second": venue_spec.requests_per_second,
+                }.items()
+                if value is not None
+            }
+        )
+        self.configure(url_host(venue_spec.pagination_url), limits)
+
+    def for_url(self, url: HttpUrl | str) -> HostLimiter:
+        host = url_host(url)
+        if host not in self.limiters:
+            self.limiters[host] = HostLimiter(host, self.default_limits)
+        return self.limiters[host]
+
+    def limit(self, url: HttpUrl | str):
+        return self.for_url(url)()
+
+    def stats(self) -> dict[str, WaitStats]:
+        return {host: limiter.stats for host, limiter in self.limiters.items()}
+
+    def log_stats(self) -> None:
+        for host, stats in self.stats().items():
+            logger.info(
+                f"{host}: {stats.requests} requests, "
+                f"mean wait {stats.mean_wait:.2f}s, max wait {stats.max_wait:.2f}s"
+            )
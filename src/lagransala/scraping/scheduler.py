@@ -0,0 +1,67 @@
+import asyncio
+from collections import Counter, OrderedDict, deque
+from typing import Generic, Hashable, Iterable, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+T = TypeVar("T")
+
+# URLs processed at once across every venue
+DEFAULT_WORKERS = 16
+
+# Recrawl runs: most pages fetched per run and minutes between daemon runs
+DEFAULT_BUDGET = 200
+DEFAULT_INTERVAL_MINUTES = 15
+
+
+class FairQueue(Generic[K, T]):
+    """Work queue shared by every venue.
+
+    `get` hands out items round-robin between keys, skipping keys that
+    already have `limit` items taken and not yet marked `done`, so a slow
+    host can't take over the worker pool.
+    """
+
+    def __init__(self) -> None:
+        self.pending: OrderedDict[K, deque[T]] = OrderedDict()
+        self.limits: dict[K, int] = {}
+        self.in_flight: Counter[K] = Counter()
+        self.condition = asyncio.Condition()
+        self.closed = False
+
+    async def put_many(self, key: K, items: Iterable[T], limit: int) -> None:
+        async with self.condition:
+            self.limits[key] = limit
+            self.pending.setdefault(key, deque()).extend(items)
+            self.condition.notify_all()
+
+    async def close(self) -> None:
+        # No more items will be put, idle `get`s return None once drained
+        async with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def _take(self) -> tuple[K, T] | None:
+        for key, items in self.pending.items():
+            if items and self.in_flight[key] < self.limits[key]:
+                item = items.popleft()
+                self.in_flight[key] += 1
+                self.pending.move_to_end(key)
+                return key, item
+        return None
+
+    async def get(self) -> tuple[K, T] | None:
+        async with self.condition:
+            while True:
+                if (taken := self._take()) is not None:
+                    return taken
+                if self.closed and not any(self.pending.values()):
+                    return None
+                await self.condition.wait()
+
+    async def done(self, key: K) -> None:
+        async with self.condition:
+            self.in_flight[key] -= 1
+            self.condition.notify_all()
+
+    def depth(self) -> dict[K, int]:
+        return {key: len(items) for key, items in self.pending.items()}
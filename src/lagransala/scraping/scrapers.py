@@ -1,91 +1,164 @@
 import logging
 import re
+from itertools import islice
+from typing import Iterable
 from urllib.parse import urljoin
 
-import aiohttp
-from bs4 import BeautifulSoup
 from langfuse.decorators.langfuse_decorator import asyncio
 from pydantic import HttpUrl, TypeAdapter
-from redis import StrictRedis
 
 from lagransala.utils.http_url_key import http_url_key
 
-from ..models import ContentBlock, ContentBlockSpec, VenueSpec
+from ..cache import CacheNamespace
+from ..models import ContentBlock, VenueSpec
+from .cpu_pool import CpuPool
+from .fetcher import HtmlFetcher, HttpStatusError, UnsupportedContentError
+from .parsers import HtmlParser
 
 logger = logging.getLogger(__name__)
 
+BLOCKS_ADAPTER = TypeAdapter(list[ContentBlock])
+
+# Cached pages held in memory ahead of their fetch, the rest is loaded as
+# these are used up
+DEFAULT_MAX_PREFETCHED = 256
+
 
 class ContentBlocksScraper:
     def __init__(
-        self, session: aiohttp.ClientSession, redis: StrictRedis, venue_spec: VenueSpec
+        self,
+        fetcher: HtmlFetcher,
+        cache: CacheNamespace,
+        venue_spec: VenueSpec,
+        parser: HtmlParser,
+        cpu_pool: CpuPool | None = None,
+        max_prefetched: int = DEFAULT_MAX_PREFETCHED,
     ) -> None:
-        self.session = session
-        self.redis = redis
-        self.redis_key = "content_blocks_scraper"
+        self.fetcher = fetcher
+        self.cache = cache
+        self.parser = parser
+        self.cpu_pool = cpu_pool
+        self.max_prefetched = max_prefetched
+        self.prefetched: dict[str, str | None] = {}
+        # Keys known to be cached but not loaded yet, and keys known missing
+        self.unloaded: dict[str, None] = {}
+        self.missing: set[str] = set()
         self.venue_spec = venue_spec
 
     async def __call__(self, url: HttpUrl) -> list[ContentBlock]:
-        key = f"{self.redis_key}:{http_url_key(url)}"
-        adapter = TypeAdapter(list[ContentBlock])
-        if data := self.redis.get(key):
-            logger.debug(f"CacheHit: {key}")
-            blocks = adapter.validate_json(data)
+        fetched = await self.fetch(url)
+        if isinstance(fetched, list):
+            return fetched
+        blocks = await self.parse(fetched)
+        await self.store(url, blocks)
+        return blocks
+
+    async def fetch(self, url: HttpUrl) -> list[ContentBlock] | str:
+        """Cached blocks when the page didn't change, its html otherwise."""
+        key = self._key(url)
+        if key in self.missing:
+            self.missing.discard(key)
+            data = None
+        elif key in self.prefetched:
+            data = self.prefetched.pop(key)
+            await self._refill()
         else:
-            text = await self._fetch_html(url)
-            soup = BeautifulSoup(text, "html.parser")
-            blocks = self._extract_content_blocks(soup)
-            self.redis.set(key, adapter.dump_json(blocks))
-        return [block.clean_markdown for block in blocks]
+            self.unloaded.pop(key, None)
+            data = await self.cache.get(key)
+        # Stop downloading as soon as every content block has been seen
+        until = self.parser.incremental(
+            [spec.selector for spec in self.venue_spec.content_block_specs]
+        )
+        try:
+            if data:
+                result = await self.fetcher.fetch_if_modified(url, until)
+            else:
+                result = await self.fetcher.fetch(url, until=until)
+        except HttpStatusError as e:
+            if not data:
+                raise
+            logger.warning(f"{e}, using the cached copy")
+            result = None
+        if result is None:
+            assert data is not None
+            logger.debug(f"CacheHit: {key}")
+            blocks = BLOCKS_ADAPTER.validate_json(data)
+            # Blocks are cached already cleaned, older entries may still be raw
+            return [
+                block if block.is_markdown else block.clean_markdown for block in blocks
+            ]
+        return result.text or ""
+
+    async def parse(self, html: str) -> list[ContentBlock]:
+        if self.cpu_pool is None:
+            return ContentBlock.clean_many(self._extract_content_blocks(html))
+        return await self.cpu_pool.content_blocks(
+            self.parser, self.venue_spec.content_block_specs, html
+        )
+
+    async def store(self, url: HttpUrl, blocks: list[ContentBlock]) -> None:
+        await self.cache.set(self._key(url), BLOCKS_ADAPTER.dump_json(blocks))
+
+    def _key(self, url: HttpUrl) -> str:
+        return self.cache.key(http_url_key(url))
+
+    async def prefetch(
+        self, urls: Iterable[HttpUrl], batch_size: int = 500
+    ) -> set[HttpUrl]:
+        """Look up the cached blocks of `urls`, returns the urls found.
+
+        Only the first `max_prefetched` are kept in memory, the rest are
+        loaded again as `fetch` uses those up.
+        """
+        keys = {self._key(url): url for url in urls}
+        found: set[HttpUrl] = set()
+        batch = list(keys)
+        for i in range(0, len(batch), batch_size):
+            cached = await self.cache.get_many(batch[i : i + batch_size])
+            for key, data in cached.items():
+                if not data:
+                    self.missing.add(key)
+                    continue
+                found.add(keys[key])
+                if len(self.prefetched) < self.max_prefetched:
+                    self.prefetched[key] = data
+                else:
+                    self.unloaded[key] = None
+        return found
+
+    async def _refill(self) -> None:
+        if not self.unloaded or len(self.prefetched) > self.max_prefetched // 2:
+            return
+        keys = list(islice(self.unloaded, self.max_prefetched - len(self.prefetched)))
+        for key in keys:
+            del self.unloaded[key]
+        self.prefetched.update(await self.cache.get_many(keys))
 
     def task(self, url: HttpUrl) -> asyncio.Task[list[ContentBlock]]:
         return asyncio.create_task(self(url))
 
-    async def _fetch_html(self, url: HttpUrl) -> str:
-        logger.info(f"Fetch html from {url}")
-        # TODO: Rate limit with semaphore
-        async with self.session.get(str(url)) as response:
-            text = await response.text()
-            return text
-
-    def _extract_content_blocks(self, soup: BeautifulSoup) -> list[ContentBlock]:
-        # Clean up the html soup
-        for element in soup.find_all(["script", "style", "nav", "header", "footer"]):
-            element.decompose()
-        blocks = [
-            self._soup_scraper(soup, spec)
-            for spec in self.venue_spec.content_block_specs
+    def _extract_content_blocks(self, html: str) -> list[ContentBlock]:
+        specs = self.venue_spec.content_block_specs
+        contents = self.parser.blocks(html, [spec.selector for spec in specs])
+        return [
+            ContentBlock(spec=spec, content=content)
+            for spec, content in zip(specs, contents)
         ]
-        return blocks
-
-    def _soup_scraper(
-        self, soup: BeautifulSoup, spec: ContentBlockSpec
-    ) -> ContentBlock:
-        if len(soup.select(spec.selector)) > 1:
-            logger.info(
-                f"More than one block found with selector `{spec.selector}` (using the first)"
-            )
-        tag = soup.select_one(spec.selector)
-
-        if tag is None:
-            logger.info(
-                f"Empty block found with selector `{spec.selector}` (relevant `{spec.relevant}`)"
-            )
-
-        block = ContentBlock(spec=spec, content=None if tag is None else str(tag))
-        return block
 
 
 class ScheduleScraper:
     def __init__(
         self,
-        http_session: aiohttp.ClientSession,
-        redis: StrictRedis,
+        fetcher: HtmlFetcher,
+        cache: CacheNamespace,
         venue_spec: VenueSpec,
+        parser: HtmlParser,
     ) -> None:
-        self.http_session = http_session
-        self.redis = redis
-        self.redis_key = "schedule_scraper"
+        self.fetcher = fetcher
+        self.cache = cache
+        self.parser = parser
         self.venue_spec = venue_spec
+        self.event_url_pattern = re.compile(venue_spec.event_url_pattern)
 
     @property
     def tasks(self) -> list[asyncio.Task[set[HttpUrl]]]:
@@ -99,29 +172,49 @@ class ScheduleScraper:
     def pages(self) -> list[HttpUrl]:
         return self.venue_spec.pagination_urls
 
-    async def _page_event_urls(self, page_url: HttpUrl) -> set[HttpUrl]:
-        key = f"{self.redis_key}:{http_url_key(page_url)}"
+    async def page_event_urls(self, page_url: HttpUrl) -> set[HttpUrl]:
+        key = self.cache.key(http_url_key(page_url))
         adapter = TypeAdapter(set[HttpUrl])
-        if data := self.redis.get(key):
+        try:
+            if data := await self.cache.get(key):
+                result = await self.fetcher.fetch_if_modified(page_url)
+            else:
+                result = await self.fetcher.fetch(page_url)
+        except UnsupportedContentError as e:
+            logger.warning(str(e))
+            return set()
+        except HttpStatusError as e:
+            # Keep the last good listing, an error page lists no events
+            if not data:
+                raise
+            logger.warning(f"{e}, using the cached copy")
+            result = None
+        if result is None:
+            assert data is not None
             logger.debug(f"CacheHit: {key}")
             return adapter.validate_json(data)
         logger.info(f"Getting page urls from {page_url}")
-        urls: set[HttpUrl] = set()
-        # TODO: Rate limit with semaphore
-        async with self.http_session.get(str(page_url)) as response:
-            soup = BeautifulSoup(await response.text(), "html.parser")
-            links = map(lambda tag: tag.get("href"), soup.select("[href]"))
-            for link in links:
-                if not isinstance(link, str):
-                    continue
-                if re.match(self.venue_spec.event_url_pattern, link):
-                    if link.startswith(("http://", "https://")):
-                        urls.add(HttpUrl(link))
-                    else:
-                        urls.add(HttpUrl(urljoin(str(page_url), link)))
-        data = adapter.dump_python(urls)
-        self.redis.set(key, adapter.dump_json(urls))
+        urls = self._event_urls(page_url, result.text or "")
+        await self.cache.set(key, adapter.dump_json(urls))
         return urls
 
+    def _event_urls(self, page_url: HttpUrl, html: str) -> set[HttpUrl]:
+        # Filter and deduplicate plain strings, only survivors become HttpUrls
+        base = str(page_url)
+        links = {
+            link if link.startswith(("http://", "https://")) else urljoin(base, link)
+            for link in set(self.parser.links(html))
+            if self.event_url_pattern.match(link)
+        }
+        return {HttpUrl(link) for link in links}
+
+    async def _listed_urls(self, page_url: HttpUrl) -> set[HttpUrl]:
+        # One missing or failing page shouldn't lose the venue's other pages
+        try:
+            return await self.page_event_urls(page_url)
+        except HttpStatusError as e:
+            logger.warning(str(e))
+            return set()
+
     def _page_task(self, page_url: HttpUrl) -> asyncio.Task[set[HttpUrl]]:
-        return asyncio.create_task(self._page_event_urls(page_url))
+        return asyncio.create_task(self._listed_urls(page_url))
@@ -8,6 +8,8 @@ T = TypeVar("T")
 
 def build_sqlmodel_type(internal_type: Type[T]) -> Type[AutoString]:
     class CustomType(AutoString):
+        cache_ok = True
+
         def process_bind_param(self, value, dialect) -> str | None:
             if value is None:
                 return None
@@ -34,6 +36,8 @@ def build_sqlmodel_type(internal_type: Type[T]) -> Type[AutoString]:
 
 def build_sqlmodel_list_type(internal_type: Type[T]) -> Type[AutoString]:
     class CustomType(AutoString):
+        cache_ok = True
+
         def process_bind_param(self, value, dialect) -> str | None:
             if value is None:
                 return None
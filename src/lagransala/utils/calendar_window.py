@@ -0,0 +1,21 @@
+from datetime import datetime, timedelta
+
+
+def today() -> datetime:
+    return datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def month_end() -> datetime:
+    next_month = datetime.now().replace(day=28) + timedelta(days=4)
+    return (next_month - timedelta(days=next_month.day)).replace(
+        hour=23, minute=59, second=59, microsecond=0
+    )
+
+
+def calendar_labels(value: datetime) -> tuple[str, str]:
+    from babel.dates import format_datetime
+
+    return (
+        format_datetime(value, format="MMMM", locale="es"),
+        format_datetime(value, format="EEEE d", locale="es"),
+    )
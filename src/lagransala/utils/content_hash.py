@@ -0,0 +1,13 @@
+import hashlib
+import json
+
+from ..models import ContentBlock
+
+
+def content_hash(blocks: list[ContentBlock]) -> str:
+    # Only what ends up in the extraction prompt takes part in the hash
+    payload = [
+        [block.spec.relevant, block.spec.irrelevant, block.content] for block in blocks
+    ]
+    data = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(data.encode()).hexdigest()
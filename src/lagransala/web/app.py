@@ -1,75 +1,103 @@
+import binascii
 from contextlib import asynccontextmanager
-from datetime import datetime, timedelta
+from datetime import datetime
+from typing import AsyncIterator, Literal
 from uuid import UUID
 
-from babel.dates import format_datetime
-from fastapi import FastAPI, HTTPException, Query, Request
-from fastapi.responses import HTMLResponse
+from fastapi import Depends, FastAPI, HTTPException, Query, Request
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pydantic import TypeAdapter
 from sqlmodel import Session, select
 
-from ..deps import INSTRUCTOR_MODEL, initialize_redis, initialize_sqlmodel
-from ..models import ContentBlock, Event, EventDateTime, SingleExtraction, Venue
+from ..cache import CacheStage
+from ..deps import (
+    INSTRUCTOR_MODEL,
+    READ_POOL_SIZE,
+    initialize_cache,
+    initialize_read_only_sqlmodel,
+)
+from ..models import (
+    ContentBlock,
+    Event,
+    EventDateTime,
+    Occurrence,
+    SingleExtraction,
+    Venue,
+)
+from ..utils.calendar_window import month_end, today
 from ..utils.http_url_key import http_url_key
-from .models import EventTrace, PublicEvent, PublicScheduledEvent
+from .database import DbSession, ReadDatabase
+from .models import (
+    EventCursor,
+    EventTrace,
+    PublicEvent,
+    PublicScheduledEvent,
+    group_by_day,
+)
+from .response_cache import CachedResponse, ResponseCache
 
 
 @asynccontextmanager
 async def lifespan(_: FastAPI):
-    print("TODO: Set up db")
     yield
+    await cache.close()
+    database.close()
 
 
 app = FastAPI(lifespan=lifespan)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
-engine = initialize_sqlmodel()
-redis = initialize_redis()
+database = ReadDatabase(initialize_read_only_sqlmodel(), READ_POOL_SIZE)
+cache = initialize_cache()
 
 
-def today() -> datetime:
-    return datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-
-
-def month_end() -> datetime:
-    next_month = datetime.now().replace(day=28) + timedelta(days=4)
-    return (next_month - timedelta(days=next_month.day)).replace(
-        hour=23, minute=59, second=59
-    )
-
-
-def get_public_event(event_id: UUID) -> PublicEvent | None:
-    with Session(engine) as session:
-        event = session.exec(
-            (
-                select(Event)
-                .join(EventDateTime)
-                .join(Venue)
-                .distinct()
-                .where(Event.id == event_id)
-            )
-        ).first()
-        return PublicEvent.from_event(event) if event else None
+async def db_session():
+    session = database.session()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def get_public_event(session: Session, event_id: UUID) -> PublicEvent | None:
+    event = session.exec(
+        (
+            select(Event)
+            .join(EventDateTime)
+            .join(Venue)
+            .distinct()
+            .where(Event.id == event_id)
+        )
+    ).first()
+    return PublicEvent.from_event(event) if event else None
 
 
-def get_public_event_trace(event_id: UUID) -> EventTrace | None:
-    event = get_public_event(event_id)
+async def get_public_event_trace(db: DbSession, event_id: UUID) -> EventTrace | None:
+    event = await db.run(get_public_event, event_id)
     if event is None:
         return None
     url = event.url
-    event_data_extractor_key = (
-        f"event_data_extractor:{INSTRUCTOR_MODEL}:{http_url_key(url)}"
+    extraction_cache = await cache.namespace(CacheStage.EXTRACTION, event.venue.slug)
+    content_blocks_cache = await cache.namespace(
+        CacheStage.CONTENT_BLOCKS, event.venue.slug
+    )
+    event_data_extractor_url_key = extraction_cache.key(
+        f"{INSTRUCTOR_MODEL}:url:{http_url_key(url)}"
     )
-    if data := redis.get(event_data_extractor_key):
+    content_blocks_scraper_key = content_blocks_cache.key(http_url_key(url))
+    cached = await cache.get_many(
+        [event_data_extractor_url_key, content_blocks_scraper_key]
+    )
+    event_data_extractor_key = cached[event_data_extractor_url_key]
+    if event_data_extractor_key and (data := await cache.get(event_data_extractor_key)):
         extraction_data = SingleExtraction.model_validate_json(data)
     else:
         extraction_data = None
-    content_blocks_scraper_key = f"content_blocks_scraper:{http_url_key(url)}"
     adapter = TypeAdapter(list[ContentBlock])
-    if data := redis.get(content_blocks_scraper_key):
+    if data := cached[content_blocks_scraper_key]:
         blocks = adapter.validate_json(data)
     else:
         blocks = None
@@ -85,32 +113,91 @@ def get_public_event_trace(event_id: UUID) -> EventTrace | None:
     return EventTrace(event=event, extraction_data=extraction_data, blocks=blocks)
 
 
-def get_public_events(since: datetime, to: datetime) -> list[PublicScheduledEvent]:
-    with Session(engine) as session:
-        events = session.exec(
-            (
-                select(Event)
-                .join(EventDateTime)
-                .join(Venue)
-                .distinct()
-                .where(EventDateTime.datetime >= since)
-                .where(EventDateTime.datetime <= to)
-            )
-        ).all()
-        return list(
-            filter(
-                lambda e: since <= e.datetime <= to,
-                sum(map(PublicScheduledEvent.from_event, events), []),
+def get_public_events(
+    session: Session,
+    since: datetime,
+    to: datetime,
+    after: EventCursor | None = None,
+    limit: int | None = None,
+) -> list[PublicScheduledEvent]:
+    rows = EventDateTime.get_scheduled_in_interval(
+        session, since, to, after.keyset if after else None, limit
+    )
+    return [PublicScheduledEvent.from_row(row) for row in rows]
+
+
+public_events_adapter = TypeAdapter(list[PublicScheduledEvent])
+response_cache = ResponseCache(cache.data_version)
+
+# Rows per query while streaming NDJSON, each batch is its own keyset query so
+# no connection is held while the client reads
+STREAM_BATCH_SIZE = 500
+
+
+async def stream_public_events(
+    since: datetime, to: datetime, after: EventCursor | None
+) -> AsyncIterator[bytes]:
+    session = database.session()
+    try:
+        while True:
+            public_events = await session.run(
+                get_public_events, since, to, after, STREAM_BATCH_SIZE
             )
-        )
+            for public_event in public_events:
+                yield public_event.model_dump_json().encode() + b"\n"
+            if len(public_events) < STREAM_BATCH_SIZE:
+                break
+            after = EventCursor.after(public_events[-1])
+    finally:
+        session.close()
 
 
 @app.get("/events/", response_model=list[PublicScheduledEvent])
 async def events(
+    request: Request,
     since: datetime = Query(default_factory=today),
     to: datetime = Query(default_factory=month_end),
-) -> list[PublicScheduledEvent]:
-    return get_public_events(since, to)
+    limit: int | None = Query(default=None, ge=1, le=1000),
+    cursor: str | None = None,
+    output: Literal["json", "ndjson"] = Query(default="json", alias="format"),
+    db: DbSession = Depends(db_session),
+) -> Response:
+    try:
+        after = EventCursor.decode(cursor) if cursor else None
+    except (ValueError, binascii.Error) as e:
+        raise HTTPException(status_code=422, detail=f"Invalid cursor: {e}")
+
+    if output == "ndjson":
+        if limit is not None:
+            raise HTTPException(
+                status_code=422, detail="`limit` is not supported with ndjson"
+            )
+        return StreamingResponse(
+            stream_public_events(since, to, after),
+            media_type="application/x-ndjson",
+        )
+
+    async def render() -> CachedResponse:
+        # One extra row tells whether there is a next page
+        public_events = await db.run(
+            get_public_events, since, to, after, limit + 1 if limit else None
+        )
+        headers = {}
+        if limit is not None and len(public_events) > limit:
+            public_events = public_events[:limit]
+            next_cursor = EventCursor.after(public_events[-1]).encode()
+            next_url = request.url.include_query_params(cursor=next_cursor)
+            headers = {
+                "X-Next-Cursor": next_cursor,
+                "Link": f'<{next_url}>; rel="next"',
+            }
+        return CachedResponse(
+            public_events_adapter.dump_json(public_events), "application/json", headers
+        )
+
+    return await response_cache.respond(
+        request, ("events", since, to, limit, cursor), render
+    )
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -118,35 +205,48 @@ async def home(
     request: Request,
     since: datetime = Query(default_factory=today),
     to: datetime = Query(default_factory=month_end),
-):
-    public_events = get_public_events(since, to)
-    public_events.sort(key=lambda x: x.datetime)
-    grouped_events: dict[str, dict[str, list[PublicScheduledEvent]]] = {}
-    for public_event in public_events:
-        month = format_datetime(public_event.datetime, format="MMMM", locale="es")
-        day = format_datetime(public_event.datetime, format="EEEE d", locale="es")
-        if public_event.datetime < since:
-            print(public_event.title, public_event.datetime)
-        grouped_events.setdefault(month, dict()).setdefault(day, []).append(
-            public_event
+    db: DbSession = Depends(db_session),
+) -> Response:
+    async def render() -> CachedResponse:
+        occurrences = await db.run(Occurrence.get_calendar, since, to)
+        response = templates.TemplateResponse(
+            "index.html",
+            {
+                "request": request,
+                "events": group_by_day(occurrences),
+            },
         )
+        return CachedResponse(bytes(response.body), "text/html")
+
+    return await response_cache.respond(request, ("home", since, to), render)
+
+
+@app.get("/event/{event_id}/", response_class=HTMLResponse)
+async def event_page(
+    request: Request, event_id: str, db: DbSession = Depends(db_session)
+):
+    try:
+        uuid = UUID(hex=event_id)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    event = await db.run(get_public_event, uuid)
+    if event is None:
+        raise HTTPException(status_code=404, detail="Event not found")
     return templates.TemplateResponse(
-        "index.html",
-        {
-            "request": request,
-            "events": grouped_events,
-        },
+        "event.html", {"request": request, "event": event}
     )
 
 
 @app.get("/event_trace/{event_id}", response_class=HTMLResponse)
-async def event_trace(request: Request, event_id: str):
+async def event_trace(
+    request: Request, event_id: str, db: DbSession = Depends(db_session)
+):
     try:
         uuid = UUID(hex=event_id)
     except ValueError as e:
         raise HTTPException(status_code=422, detail=str(e))
     else:
-        event_trace = get_public_event_trace(uuid)
+        event_trace = await get_public_event_trace(db, uuid)
         if event_trace is None:
             raise HTTPException(status_code=404, detail="Event not found")
         return templates.TemplateResponse(
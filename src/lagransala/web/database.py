@@ -0,0 +1,59 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Concatenate, ParamSpec, TypeVar
+
+from sqlalchemy import Engine
+from sqlmodel import Session
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+
+class ReadDatabase:
+    # Blocking queries run on a thread pool sized like the engine's pool, so
+    # they never block the event loop
+    def __init__(self, engine: Engine, max_workers: int) -> None:
+        self.engine = engine
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix="db")
+
+    async def run(self, fn: Callable[[], T]) -> T:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn)
+
+    def session(self) -> "DbSession":
+        return DbSession(self)
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+        self.engine.dispose()
+
+
+class DbSession:
+    # A request's session, opened on its first query. Queries of one request
+    # run one at a time, so the session is never used by two threads at once.
+    def __init__(self, database: ReadDatabase) -> None:
+        self.database = database
+        self.session: Session | None = None
+
+    async def run(
+        self,
+        fn: Callable[Concatenate[Session, P], T],
+        *args: P.args,
+        **kwargs: P.kwargs,
+    ) -> T:
+        def call() -> T:
+            if self.session is None:
+                self.session = Session(self.database.engine, expire_on_commit=False)
+            try:
+                return fn(self.session, *args, **kwargs)
+            finally:
+                # Hand the connection back to the pool right away, otherwise
+                # waiting requests could hold every connection while the
+                # workers that would release them wait for one
+                self.session.commit()
+
+        return await self.database.run(call)
+
+    def close(self) -> None:
+        if self.session is not None:
+            self.session.close()
+            self.session = None
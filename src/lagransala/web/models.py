@@ -1,8 +1,10 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from datetime import datetime, timedelta
-from typing import Self
+from typing import Self, Sequence
 from uuid import UUID
 
 from pydantic import BaseModel, Field, HttpUrl
+from sqlalchemy import Row
 
 from ..models import ContentBlock, Event, SingleExtraction, Venue
 
@@ -67,3 +69,46 @@ class PublicScheduledEvent(BaseModel):
             )
             for datetime in event.schedule
         ]
+
+    @classmethod
+    def from_row(cls, row: Row) -> Self:
+        return cls(
+            id=row.id.hex,
+            venue=PublicVenueMetadata(slug=row.venue_slug, name=row.venue_name),
+            datetime=row.datetime,
+            title=row.title,
+            description=row.description,
+            duration=row.duration,
+            url=row.url,
+        )
+
+
+class EventCursor(BaseModel):
+    # Keyset of the last occurrence of a page, opaque to API clients
+    datetime: datetime
+    event_id: UUID
+
+    @classmethod
+    def after(cls, event: PublicScheduledEvent) -> Self:
+        return cls(datetime=event.datetime, event_id=UUID(hex=event.id))
+
+    @classmethod
+    def decode(cls, cursor: str) -> Self:
+        padding = "=" * (-len(cursor) % 4)
+        return cls.model_validate_json(urlsafe_b64decode(cursor + padding))
+
+    def encode(self) -> str:
+        return urlsafe_b64encode(self.model_dump_json().encode()).decode().rstrip("=")
+
+    @property
+    def keyset(self) -> tuple[datetime, UUID]:
+        return (self.datetime, self.event_id)
+
+
+def group_by_day(occurrences: Sequence[Row]) -> dict[str, dict[str, list[Row]]]:
+    grouped: dict[str, dict[str, list[Row]]] = {}
+    for occurrence in occurrences:
+        grouped.setdefault(occurrence.month_label, dict()).setdefault(
+            occurrence.day_label, []
+        ).append(occurrence)
+    return grouped
@@ -0,0 +1,101 @@
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Hashable
+
+from fastapi import Request, Response
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+
+class CachedResponse:
+    def __init__(
+        self, body: bytes, media_type: str, headers: dict[str, str] | None = None
+    ) -> None:
+        self.body = body
+        self.media_type = media_type
+        self.headers = headers or {}
+        self.etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison
+    return any(
+        candidate.strip().removeprefix("W/") == etag
+        for candidate in if_none_match.split(",")
+    )
+
+
+class ResponseCache:
+    """In-memory LRU of rendered responses.
+
+    Entries are keyed on the data version too, so those rendered before the
+    last extraction commit are never served again, they just age out of the
+    LRU. The version is read at most every `version_ttl` seconds, and while
+    it can't be read responses are rendered without caching.
+    """
+
+    def __init__(
+        self,
+        data_version: Callable[[], Awaitable[int]],
+        max_entries: int = 256,
+        version_ttl: float = 1,
+    ) -> None:
+        self.data_version = data_version
+        self.max_entries = max_entries
+        self.version_ttl = version_ttl
+        self.entries: OrderedDict[Hashable, CachedResponse] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.version: int | None = None
+        self.version_expires = 0.0
+
+    async def current_version(self) -> int | None:
+        now = time.monotonic()
+        if now < self.version_expires:
+            return self.version
+        try:
+            self.version = await self.data_version()
+        except (RedisError, OSError) as e:
+            logger.warning(f"Data version unavailable, not caching responses: {e}")
+            self.version = None
+        self.version_expires = now + self.version_ttl
+        return self.version
+
+    async def get_or_render(
+        self, key: Hashable, render: Callable[[], Awaitable[CachedResponse]]
+    ) -> CachedResponse:
+        cached = self.entries.get(key)
+        if cached is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return cached
+        self.misses += 1
+        cached = await render()
+        self.entries[key] = cached
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return cached
+
+    async def respond(
+        self,
+        request: Request,
+        key: Hashable,
+        render: Callable[[], Awaitable[CachedResponse]],
+    ) -> Response:
+        version = await self.current_version()
+        if version is None:
+            cached = await render()
+        else:
+            cached = await self.get_or_render((version, key), render)
+        headers = {**cached.headers, "ETag": cached.etag, "Cache-Control": "no-cache"}
+        if etag_matches(request, cached.etag):
+            return Response(status_code=304, headers=headers)
+        return Response(cached.body, media_type=cached.media_type, headers=headers)
@@ -0,0 +1,146 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Sequence
+
+from jinja2 import Environment, FileSystemLoader
+from pydantic import BaseModel
+from sqlalchemy import Row
+
+from .models import PublicEvent, PublicScheduledEvent, group_by_day
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = ".manifest.json"
+
+
+class BuildStats(BaseModel):
+    rendered: int = 0
+    unchanged: int = 0
+    removed: int = 0
+
+
+class Page:
+    def __init__(
+        self, path: str, template: str, context: dict[str, Any], data: bytes
+    ) -> None:
+        self.path = path
+        self.template = template
+        self.context = context
+        # Everything the page is rendered from, used to skip unchanged pages
+        self.data = data
+
+
+def event_pages(public_events: list[PublicScheduledEvent]) -> list[Page]:
+    schedules: dict[str, list[datetime]] = {}
+    firsts: dict[str, PublicScheduledEvent] = {}
+    for public_event in public_events:
+        schedules.setdefault(public_event.id, []).append(public_event.datetime)
+        firsts.setdefault(public_event.id, public_event)
+    pages: list[Page] = []
+    for event_id, first in firsts.items():
+        event = PublicEvent(
+            **first.model_dump(exclude={"datetime"}), schedule=schedules[event_id]
+        )
+        pages.append(
+            Page(
+                f"event/{event_id}/index.html",
+                "event.html",
+                {"event": event},
+                event.model_dump_json().encode(),
+            )
+        )
+    return pages
+
+
+def calendar_pages(
+    occurrences: Sequence[Row], since: datetime, to: datetime
+) -> list[Page]:
+    def page(path: str, rows: list[Row]) -> Page:
+        data = json.dumps([list(row) for row in rows], default=str)
+        return Page(path, "index.html", {"events": group_by_day(rows)}, data.encode())
+
+    months: dict[str, list[Row]] = {}
+    days: dict[str, list[Row]] = {}
+    for occurrence in occurrences:
+        months.setdefault(occurrence.datetime.strftime("%Y-%m"), []).append(occurrence)
+        days.setdefault(occurrence.datetime.strftime("%Y-%m-%d"), []).append(occurrence)
+    home = [row for row in occurrences if since <= row.datetime <= to]
+    return [
+        page("index.html", home),
+        *(page(f"{month}/index.html", rows) for month, rows in months.items()),
+        *(page(f"{day}/index.html", rows) for day, rows in days.items()),
+    ]
+
+
+class SiteBuilder:
+    def __init__(
+        self,
+        output: Path,
+        templates: Path = Path("templates"),
+        static: Path = Path("static"),
+    ) -> None:
+        self.output = output
+        self.templates = templates
+        self.static = static
+        self.env = Environment(loader=FileSystemLoader(templates), autoescape=True)
+
+    def templates_version(self) -> str:
+        digest = hashlib.sha256()
+        for path in sorted(self.templates.glob("*.html")):
+            digest.update(path.name.encode())
+            digest.update(path.read_bytes())
+        return digest.hexdigest()
+
+    def load_manifest(self) -> dict[str, Any]:
+        try:
+            return json.loads((self.output / MANIFEST).read_text())
+        except FileNotFoundError:
+            return {}
+
+    def write(self, path: str, content: str | bytes) -> None:
+        target = self.output / path
+        target.parent.mkdir(parents=True, exist_ok=True)
+        # Write then rename so a static server never serves a partial page
+        tmp = target.with_name(f".{target.name}.tmp")
+        if isinstance(content, str):
+            tmp.write_text(content)
+        else:
+            tmp.write_bytes(content)
+        os.replace(tmp, target)
+
+    def build(self, pages: list[Page], force: bool = False) -> BuildStats:
+        stats = BuildStats()
+        manifest = self.load_manifest()
+        version = self.templates_version()
+        previous: dict[str, str] = (
+            manifest.get("pages", {})
+            if manifest.get("templates") == version and not force
+            else {}
+        )
+        hashes: dict[str, str] = {}
+        for page in pages:
+            hashes[page.path] = hashlib.sha256(page.data).hexdigest()
+            if previous.get(page.path) == hashes[page.path] and (
+                (self.output / page.path).exists()
+            ):
+                stats.unchanged += 1
+                continue
+            template = self.env.get_template(page.template)
+            self.write(page.path, template.render(**page.context, static=True))
+            stats.rendered += 1
+        for path in manifest.get("pages", {}).keys() - hashes.keys():
+            (self.output / path).unlink(missing_ok=True)
+            stats.removed += 1
+        if self.static.is_dir():
+            shutil.copytree(self.static, self.output / "static", dirs_exist_ok=True)
+        self.write(MANIFEST, json.dumps({"templates": version, "pages": hashes}))
+        logger.info(
+            f"Site built in {self.output}: {stats.rendered} rendered, "
+            f"{stats.unchanged} unchanged, {stats.removed} removed"
+        )
+        return stats
@@ -0,0 +1,192 @@
+import asyncio
+import json
+from typing import Any, Callable
+
+from pydantic import ValidationError
+
+from lagransala.models import ContentBlock, ContentBlockSpec, SingleExtraction
+from lagransala.scraping.batch import (
+    Batch,
+    BatchExtraction,
+    BatchFailedError,
+    BatchIncompleteError,
+    BatchProvider,
+    BatchResult,
+)
+from lagransala.scraping.completions import completion_body, parse_completion
+from lagransala.scraping.job_ledger import TRANSIENT_ERRORS
+
+EVENT = {
+    "event_data": {
+        "schedule": ["2030-01-01T20:00:00"],
+        "title": "Title",
+        "author": "Author",
+        "description": "Description",
+        "duration": "90",
+    },
+    "extraction_error": None,
+}
+
+
+def completion(arguments: str) -> dict[str, Any]:
+    tool_call = {"function": {"name": "SingleExtraction", "arguments": arguments}}
+    return {"choices": [{"message": {"tool_calls": [tool_call]}}]}
+
+
+class InMemoryBatchProvider(BatchProvider):
+    """Answers every request of a batch with `respond`, the batch ends as
+    `status` and the requests in `unanswered` get no result at all."""
+
+    def __init__(
+        self,
+        respond: Callable[[dict[str, Any]], BatchResult],
+        status: str = "completed",
+        unanswered: set[str] | None = None,
+    ) -> None:
+        self.respond = respond
+        self.status = status
+        self.unanswered = unanswered or set()
+        self.batches: dict[str, list[dict[str, Any]]] = {}
+
+    async def submit(self, requests: list[dict[str, Any]]) -> Batch:
+        batch = Batch(id=f"batch_{len(self.batches)}", status="validating")
+        self.batches[batch.id] = requests
+        return batch
+
+    async def get(self, batch_id: str) -> Batch:
+        return Batch(id=batch_id, status=self.status)
+
+    async def results(self, batch: Batch) -> list[BatchResult]:
+        return [
+            self.respond(request)
+            for request in self.batches[batch.id]
+            if request["custom_id"] not in self.unanswered
+        ]
+
+
+class FakeExtractor:
+    # What `BatchExtraction` uses of `EventDataExtractor`, without its client
+    # and prompt
+    def __init__(self) -> None:
+        self.stored: list[str] = []
+
+    def batch_body(self, content_blocks: list[ContentBlock]) -> dict[str, Any]:
+        return completion_body(
+            "model", 1024, "Events of {{ current_year }}", content_blocks
+        )
+
+    parse_completion = staticmethod(parse_completion)
+
+    async def store(self, url, content_blocks, cache, extraction_data) -> None:
+        self.stored.append(str(url))
+
+
+def page(url: str) -> tuple[str, str, list[ContentBlock], None]:
+    spec = ContentBlockSpec(selector="main", relevant="The event")
+    return url, url, [ContentBlock(spec=spec, content=url)], None
+
+
+def run(
+    provider: BatchProvider, urls: list[str], max_requests: int = 100
+) -> tuple[dict[str, SingleExtraction | Exception], FakeExtractor]:
+    extractor = FakeExtractor()
+    batch: BatchExtraction[str] = BatchExtraction(
+        provider,
+        extractor,  # type: ignore[arg-type]
+        poll_interval=0,
+        max_requests=max_requests,
+    )
+    for url in urls:
+        batch.add(*page(url))  # type: ignore[arg-type]
+    results: dict[str, SingleExtraction | Exception] = {}
+
+    async def done(item: str, result: SingleExtraction | Exception) -> None:
+        results[item] = result
+
+    asyncio.run(batch.run(done))
+    return results, extractor
+
+
+def test_completed_batch():
+    provider = InMemoryBatchProvider(
+        lambda request: BatchResult(
+            custom_id=request["custom_id"], completion=completion(json.dumps(EVENT))
+        )
+    )
+    results, extractor = run(provider, ["https://a.com/1", "https://a.com/2"])
+    assert all(isinstance(result, SingleExtraction) for result in results.values())
+    assert results["https://a.com/1"].event_data.title == "Title"
+    assert sorted(extractor.stored) == ["https://a.com/1", "https://a.com/2"]
+    (requests,) = provider.batches.values()
+    body = requests[0]["body"]
+    assert body["model"] == "model"
+    assert "https://a.com/1" in body["messages"][1]["content"]
+    assert "{{" not in body["messages"][0]["content"]
+    # The answer is parsed from the very tool the request forces
+    tool = body["tool_choice"]["function"]["name"]
+    assert tool == body["tools"][0]["function"]["name"] == "SingleExtraction"
+
+
+def test_request_error():
+    def respond(request: dict[str, Any]) -> BatchResult:
+        if request["custom_id"] == "0":
+            return BatchResult(custom_id="0", error="context_length_exceeded")
+        return BatchResult(
+            custom_id=request["custom_id"], completion=completion(json.dumps(EVENT))
+        )
+
+    results, extractor = run(
+        InMemoryBatchProvider(respond), ["https://a.com/1", "https://a.com/2"]
+    )
+    assert isinstance(results["https://a.com/1"], BatchFailedError)
+    assert not isinstance(results["https://a.com/1"], TRANSIENT_ERRORS)
+    assert isinstance(results["https://a.com/2"], SingleExtraction)
+    assert extractor.stored == ["https://a.com/2"]
+
+
+def test_invalid_tool_call():
+    answers = {
+        "0": completion(json.dumps({"event_data": {"title": "Title"}})),
+        "1": {"choices": [{"message": {"content": "No tool call"}}]},
+    }
+    provider = InMemoryBatchProvider(
+        lambda request: BatchResult(
+            custom_id=request["custom_id"], completion=answers[request["custom_id"]]
+        )
+    )
+    results, extractor = run(provider, ["https://a.com/1", "https://a.com/2"])
+    assert isinstance(results["https://a.com/1"], ValidationError)
+    assert isinstance(results["https://a.com/2"], KeyError)
+    assert extractor.stored == []
+
+
+def test_expired_batch_with_partial_output():
+    provider = InMemoryBatchProvider(
+        lambda request: BatchResult(
+            custom_id=request["custom_id"], completion=completion(json.dumps(EVENT))
+        ),
+        status="expired",
+        unanswered={"1"},
+    )
+    results, extractor = run(provider, ["https://a.com/1", "https://a.com/2"])
+    assert isinstance(results["https://a.com/1"], SingleExtraction)
+    assert isinstance(results["https://a.com/2"], BatchIncompleteError)
+    assert isinstance(results["https://a.com/2"], TRANSIENT_ERRORS)
+    assert extractor.stored == ["https://a.com/1"]
+
+
+def test_bad_response_loses_only_its_chunk():
+    class MissingIdProvider(InMemoryBatchProvider):
+        async def submit(self, requests: list[dict[str, Any]]) -> Batch:
+            if "https://a.com/1" in requests[0]["body"]["messages"][1]["content"]:
+                raise KeyError("id")
+            return await super().submit(requests)
+
+    provider = MissingIdProvider(
+        lambda request: BatchResult(
+            custom_id=request["custom_id"], completion=completion(json.dumps(EVENT))
+        )
+    )
+    results, _ = run(provider, ["https://a.com/1", "https://a.com/2"], 1)
+    assert isinstance(results["https://a.com/1"], BatchFailedError)
+    assert isinstance(results["https://a.com/2"], SingleExtraction)